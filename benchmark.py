@@ -0,0 +1,208 @@
+#!/bin/env python
+
+# Conditions Of Use
+#
+# This software was developed by employees of the National Institute of
+# Standards and Technology (NIST), and others.
+# This software has been contributed to the public domain.
+# Pursuant to title 15 United States Code Section 105, works of NIST
+# employees are not subject to copyright protection in the United States
+# and are considered to be in the public domain.
+# As a result, a formal license is not needed to use this software.
+#
+# This software is provided "AS IS."
+# NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+# OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+# AND DATA ACCURACY.  NIST does not warrant or make any representations
+# regarding the use of the software or the results thereof, including but
+# not limited to the correctness, accuracy, reliability or usefulness of
+# this software.
+
+# Tony Cheneau <tony.cheneau@nist.gov>
+
+import gc, json, os, platform, socket, subprocess, sys, tempfile
+from errno import EAGAIN
+from timeit import default_timer
+from logger.generator import MessageGenerator
+from logger.parser import parse_onenode, parse_twonodes, parse_manynodes, \
+                          parse_packet, TextLogger
+from logger.framer import IEEE802154Framer, Frame, mac_payload_offset
+from logger.dispatch import DispatchTable
+from logger.parser import LOG_HEADER
+
+PERCENTILES = [50, 90, 99, 99.9]
+# simulation time of the generated data frames, so that the corpora only
+# depend on the seed
+TIME_BASE = 1e9
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.))
+    return sorted_values[index]
+
+def measure(function, corpus, repeat):
+    """call function on each item of the corpus, return the throughput
+    (calls per second, best of repeat runs) and the latency percentiles of
+    a single call (in microseconds)"""
+    gc.disable()
+    try:
+        best = None
+        for i in xrange(repeat):
+            start = default_timer()
+            for item in corpus:
+                function(item)
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        latencies = []
+        for item in corpus:
+            start = default_timer()
+            function(item)
+            latencies.append(default_timer() - start)
+    finally:
+        gc.enable()
+    latencies.sort()
+    result = {"calls": len(corpus),
+              "msgs_per_sec": len(corpus) / best if best else None,
+              "latency_us": dict(("p%s" % p, 1e6 * percentile(latencies, p))
+                                 for p in PERCENTILES)}
+    result["latency_us"]["max"] = 1e6 * latencies[-1]
+    return result
+
+def corpus(kind, size, seed):
+    """generate size messages of a kind (see logger.generator)"""
+    return MessageGenerator(100, [(kind, 1)], seed=seed, time_base=TIME_BASE).pool(size)
+
+def tmpfs_directory():
+    for directory in ("/dev/shm", "/run/shm"):
+        if os.path.isdir(directory) and os.access(directory, os.W_OK):
+            return directory
+    return None
+
+class StubNodeInfo(object):
+    """node information updated by the viewer (e.g. RPL parents)"""
+    parents = None
+
+class StubSensorNode(object):
+    def __init__(self):
+        self.node_info = StubNodeInfo()
+
+class StubSensorMap(object):
+    """SensorMap that does not draw anything"""
+    def __init__(self):
+        self.node = StubSensorNode() # stands for every node
+    def node_change_color(self, identifier, color):
+        pass
+    def node_status_change_color(self, identifier, color):
+        pass
+    def line_add(self, A, B, color=None):
+        pass
+    def line_del(self, A, B):
+        pass
+    def arrows_create(self, source, destinations, lifetime=.2, color=None):
+        pass
+    def node_lookup(self, identifier):
+        return self.node
+
+class StubSource(object):
+    """datagram source that never delivers anything"""
+    def setblocking(self, flag):
+        pass
+    def recvfrom(self, size):
+        raise socket.error(EAGAIN, "no datagram")
+
+def viewer_dispatcher():
+    """build a viewer Dispatcher that does not listen to the network nor
+    draw anything, or return None if the viewer cannot be loaded"""
+    try:
+        import pyglet
+    except ImportError:
+        print >> sys.stderr, "pyglet is not available"
+        return None
+    # nothing is drawn, no OpenGL context is needed (nor a display)
+    pyglet.options['shadow_window'] = False
+    try:
+        from viewer.dispatcher import Dispatcher
+    except Exception, e: # the exception raised without a display depends on the platform
+        print >> sys.stderr, "cannot load the viewer: %s" % e
+        return None
+    return Dispatcher(None, None, StubSensorMap(), source=StubSource())
+
+def benchmarks(size, seed):
+    """return a list of (name, function, corpus) to measure"""
+    onenode = corpus("node", size, seed)
+    twonodes = corpus("link", size, seed)
+    manynodes = corpus("rpl", size, seed)
+    packets = corpus("frame", size, seed)
+    frames = [parse_packet(packet, 1).frame.tobytes() for packet in packets]
+    mixed = MessageGenerator(100, [("join", 1), ("exit", 1), ("link", 4), ("node", 4),
+                                   ("rpl", 2), ("frame", 8)], seed=seed,
+                               time_base=TIME_BASE).pool(size)
+    entries = []
+    table = DispatchTable()
+    table.subscribe(entries.append, LOG_HEADER)
+    for message in mixed:
+        table.dispatch(message)
+
+    tests = [("parse_onenode", lambda data: parse_onenode(data, 2), onenode),
+             ("parse_twonodes", lambda data: parse_twonodes(data, 2), twonodes),
+             ("parse_manynodes", lambda data: parse_manynodes(data, 2), manynodes),
+             ("parse_packet", lambda data: parse_packet(data, 1), packets),
+             ("compute_mac_payload_offset",
+              lambda frame: IEEE802154Framer(frame).compute_mac_payload_offset(), frames),
+             ("mac_payload_offset", mac_payload_offset, frames),
+             ("Frame.payload_type", lambda frame: Frame(frame).payload_type, frames)]
+
+    null_logger = TextLogger(open(os.devnull, "w"))
+    tests.append(("TextLogger.write /dev/null", null_logger.write, entries))
+    directory = tmpfs_directory()
+    if directory:
+        fd = tempfile.TemporaryFile(dir=directory)
+        tests.append(("TextLogger.write tmpfs", TextLogger(fd).write, entries))
+
+    logger_table = DispatchTable()
+    logger_table.subscribe(null_logger.write, LOG_HEADER)
+    tests.append(("logger DispatchTable.dispatch", logger_table.dispatch, mixed))
+
+    dispatcher = viewer_dispatcher()
+    if dispatcher:
+        tests.append(("viewer Dispatcher.dispatch", dispatcher.dispatch, mixed))
+    else:
+        print >> sys.stderr, "skipping the viewer benchmark"
+    return tests
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(usage= "benchmark the hot paths of the logger and the viewer",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-n", "--size", help="number of messages in each corpus", type=int, default=20000)
+    parser.add_argument("-r", "--repeat", help="number of runs (the best one is kept)", type=int, default=5)
+    parser.add_argument("-s", "--seed", help="seed of the corpus generator", type=int, default=154)
+    parser.add_argument("-k", "--only", help="only run the benchmarks whose name contains ONLY", default=None)
+    parser.add_argument("-o", "--output", help="output file (default: <stdout>)", default=None)
+
+    args = parser.parse_args()
+
+    results = {}
+    for name, function, items in benchmarks(args.size, args.seed):
+        if args.only and args.only not in name:
+            continue
+        print >> sys.stderr, "running %s" % name
+        results[name] = measure(function, items, args.repeat)
+
+    report = {"revision": git_revision(),
+              "python": platform.python_version(),
+              "size": args.size,
+              "repeat": args.repeat,
+              "seed": args.seed,
+              "results": results}
+    output = open(args.output, "w") if args.output else sys.stdout
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write("\n")
@@ -0,0 +1,47 @@
+#!/bin/env python
+
+# Conditions Of Use
+#
+# This software was developed by employees of the National Institute of
+# Standards and Technology (NIST), and others.
+# This software has been contributed to the public domain.
+# Pursuant to title 15 United States Code Section 105, works of NIST
+# employees are not subject to copyright protection in the United States
+# and are considered to be in the public domain.
+# As a result, a formal license is not needed to use this software.
+#
+# This software is provided "AS IS."
+# NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+# OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+# AND DATA ACCURACY.  NIST does not warrant or make any representations
+# regarding the use of the software or the results thereof, including but
+# not limited to the correctness, accuracy, reliability or usefulness of
+# this software.
+
+# Tony Cheneau <tony.cheneau@nist.gov>
+
+from logger.bulk import FrameColumns
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(usage= "summarize the data frames sent by each node in a binary log",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("binary", help="binary log file (recorded with logger.py --binary)", type=str)
+
+    args = parser.parse_args()
+
+    frames = FrameColumns.from_file(args.binary)
+    transmit_counts = frames.transmit_counts()
+    good, bad = frames.fanout()
+    akm, other = frames.akm_counts()
+
+    print "%d frames sent by %d nodes" % (frames.count, len(frames.nodes()))
+    print "{0:>6} {1:>10} {2:>10} {3:>10} {4:>10}".format("node", "frames", "good/frame",
+                                                          "bad/frame", "AKM ratio")
+    for node in frames.nodes():
+        count = float(transmit_counts[node])
+        print "{0:>6} {1:>10} {2:>10.2f} {3:>10.2f} {4:>10.2f}".format(node, int(count),
+                                                                      good[node] / count,
+                                                                      bad[node] / count,
+                                                                      akm[node] / count)
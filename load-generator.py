@@ -0,0 +1,66 @@
+#!/bin/env python
+
+# Conditions Of Use
+#
+# This software was developed by employees of the National Institute of
+# Standards and Technology (NIST), and others.
+# This software has been contributed to the public domain.
+# Pursuant to title 15 United States Code Section 105, works of NIST
+# employees are not subject to copyright protection in the United States
+# and are considered to be in the public domain.
+# As a result, a formal license is not needed to use this software.
+#
+# This software is provided "AS IS."
+# NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+# OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+# AND DATA ACCURACY.  NIST does not warrant or make any representations
+# regarding the use of the software or the results thereof, including but
+# not limited to the correctness, accuracy, reliability or usefulness of
+# this software.
+
+# Tony Cheneau <tony.cheneau@nist.gov>
+
+from logger.network import multicast_sender
+from logger.generator import MessageGenerator, LoadGenerator, parse_mix, end_message
+
+def report(sent, elapsed):
+    print "%.0f messages/s" % (sent / elapsed)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(usage= "send synthetic wiredto154 simulation messages to a multicast group",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-a", "--address", help="IP address of the multicast group", default="224.1.1.1")
+    parser.add_argument("-p", "--port", help="destination port", type=int, default=10000)
+    parser.add_argument("-n", "--nodes", help="number of simulated nodes", type=int, default=100)
+    parser.add_argument("-m", "--mix", help="proportions of the messages kinds (join, exit, link, node, rpl, frame)",
+                        default="join=1,exit=1,link=4,node=4,rpl=2,frame=8")
+    parser.add_argument("-r", "--rate", help="target rate (in messages per second, 0 sends as fast as possible)", type=float, default=1000.)
+    parser.add_argument("-b", "--burst-size", help="number of messages sent back to back", type=int, default=1)
+    parser.add_argument("-d", "--duration", help="duration of the test (in seconds)", type=float, default=10.)
+    parser.add_argument("-c", "--count", help="stop after sending COUNT messages", type=int, default=None)
+    parser.add_argument("-P", "--pool-size", help="number of distinct messages generated before the test", type=int, default=4096)
+    parser.add_argument("-s", "--seed", help="seed of the random generator", type=int, default=None)
+    parser.add_argument("-e", "--end", help="send a simulation end message when done", action="store_true")
+    parser.add_argument("-q", "--quiet", help="only report the achieved rate at the end of the test", action="store_true")
+
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError, e:
+        parser.error(str(e))
+
+    messages = MessageGenerator(args.nodes, mix, seed=args.seed).pool(args.pool_size)
+    sock, destination = multicast_sender(args.address, args.port)
+    generator = LoadGenerator(sock, destination, messages,
+                              rate=args.rate or None, burst_size=args.burst_size)
+    try:
+        generator.run(duration=args.duration, count=args.count,
+                      report=None if args.quiet else report)
+    except KeyboardInterrupt:
+        pass
+    if args.end:
+        sock.sendto(end_message(), destination)
+    print generator.stats()
@@ -0,0 +1,42 @@
+#!/bin/env python
+
+# Conditions Of Use
+#
+# This software was developed by employees of the National Institute of
+# Standards and Technology (NIST), and others.
+# This software has been contributed to the public domain.
+# Pursuant to title 15 United States Code Section 105, works of NIST
+# employees are not subject to copyright protection in the United States
+# and are considered to be in the public domain.
+# As a result, a formal license is not needed to use this software.
+#
+# This software is provided "AS IS."
+# NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+# OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+# AND DATA ACCURACY.  NIST does not warrant or make any representations
+# regarding the use of the software or the results thereof, including but
+# not limited to the correctness, accuracy, reliability or usefulness of
+# this software.
+
+# Tony Cheneau <tony.cheneau@nist.gov>
+
+from sys import stdout
+from logger.binlog import BinaryLogReader, convert_to_text
+from logger.parser import TextLogger
+from logger.tools import prettyfile
+
+if __name__ == "__main__":
+    import argparse
+    stdout = prettyfile(stdout)
+    parser = argparse.ArgumentParser(usage= "convert a binary log to the text format of the logger",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("binary", help="binary log file (recorded with logger.py --binary)", type=str)
+    parser.add_argument("-f", "--filename", help="output file", type=str, default=stdout)
+    parser.add_argument("-m", "--mmap", help="memory map the binary log instead of reading it", action="store_true")
+
+    args = parser.parse_args()
+
+    reader = BinaryLogReader(args.binary, use_mmap=args.mmap)
+    logger = TextLogger(args.filename, flush_interval=None)
+    convert_to_text(reader, logger)
@@ -0,0 +1,45 @@
+#!/bin/env python
+
+# Conditions Of Use
+#
+# This software was developed by employees of the National Institute of
+# Standards and Technology (NIST), and others.
+# This software has been contributed to the public domain.
+# Pursuant to title 15 United States Code Section 105, works of NIST
+# employees are not subject to copyright protection in the United States
+# and are considered to be in the public domain.
+# As a result, a formal license is not needed to use this software.
+#
+# This software is provided "AS IS."
+# NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+# OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+# AND DATA ACCURACY.  NIST does not warrant or make any representations
+# regarding the use of the software or the results thereof, including but
+# not limited to the correctness, accuracy, reliability or usefulness of
+# this software.
+
+# Tony Cheneau <tony.cheneau@nist.gov>
+
+from logger.binlog import BinaryLogReader, BinaryLogError
+from logger.columnar import columnar_writer, export_binary, export_text
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(usage= "export a log to a columnar file",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("log", help="binary or text log file", type=str)
+    parser.add_argument("output", help="output file (Parquet) or directory (raw columns)", type=str)
+    parser.add_argument("-c", "--chunk-size", help="number of events per chunk", type=int, default=65536)
+    parser.add_argument("-r", "--raw", help="store raw columns even if pyarrow is installed", action="store_true")
+
+    args = parser.parse_args()
+
+    writer = columnar_writer(args.output, args.chunk_size, parquet=False if args.raw else None)
+    reader = BinaryLogReader(args.log, use_mmap=True)
+    try:
+        export_binary(reader, writer)
+    except BinaryLogError: # this is a text log
+        skipped = export_text(args.log, writer)
+        if skipped:
+            print "skipped %d lines that are not events" % skipped
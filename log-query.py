@@ -0,0 +1,47 @@
+#!/bin/env python
+
+# Conditions Of Use
+#
+# This software was developed by employees of the National Institute of
+# Standards and Technology (NIST), and others.
+# This software has been contributed to the public domain.
+# Pursuant to title 15 United States Code Section 105, works of NIST
+# employees are not subject to copyright protection in the United States
+# and are considered to be in the public domain.
+# As a result, a formal license is not needed to use this software.
+#
+# This software is provided "AS IS."
+# NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+# OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+# AND DATA ACCURACY.  NIST does not warrant or make any representations
+# regarding the use of the software or the results thereof, including but
+# not limited to the correctness, accuracy, reliability or usefulness of
+# this software.
+
+# Tony Cheneau <tony.cheneau@nist.gov>
+
+from sys import stdout
+from logger.index import LogIndex, LogIndexError, build_index
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(usage= "extract events from a log using its index",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("log", help="log file (written by logger.py --index)", type=str)
+    parser.add_argument("-n", "--node", help="only show events involving this node", type=int, default=None)
+    parser.add_argument("-s", "--start", help="only show events logged after START (in seconds)", type=float, default=None)
+    parser.add_argument("-e", "--end", help="only show events logged before END (in seconds)", type=float, default=None)
+    parser.add_argument("-b", "--build", help="(re)build the index of the log before querying it", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.build:
+        build_index(args.log)
+
+    try:
+        index = LogIndex(args.log)
+    except LogIndexError, e:
+        parser.error("%s, e.g. with --build" % e)
+    for line in index.query(node=args.node, start=args.start, end=args.end):
+        stdout.write(line)
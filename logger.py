@@ -23,35 +23,101 @@
 
 from signal import signal, SIGINT
 from sys import stdout
-from logger.network import multicast_listener
-from logger.parser import dispatcher, TextLogger
-from logger.tools import PRINT, set_verbose
-import socket
-
-class prettyfile(object):
-    """a class of file that prints out nicely when str() or repr() is called"""
-    fileobj = None
-    def __init__(self, fileobj):
-        self.fileobj = fileobj
-    def __str__(self):
-        return self.fileobj.name
-    def write(self, data):
-        self.fileobj.write(data)
-    def flush(self):
-        self.fileobj.flush()
-
+from logger.network import multicast_listener, kernel_drops, receive_queue, BatchReceiver
+from logger.parser import LOG_HEADER, SIM_END, OUTBOUND_FRAME, TextLogger, end_of_simulation, \
+                          subtypes
+from logger.dispatch import DispatchTable
+from logger.binlog import BinaryLogger
+from logger.index import LogIndexWriter, index_filename
+from logger.replay import ReplaySource
+from logger.columnar import columnar_writer
+from logger.daemon import Group, MulticastDaemon
+from logger.pipeline import ShardedLogger
+from logger.simtime import LatencyMonitor
+from logger.metrics import MetricsRegistry, MetricsServer
+from logger.profiling import StageProfiler
+from logger.tools import PRINT, set_verbose, at_simulation_end, prettyfile
+from errno import EINTR
+import select, socket, sys, time
 
 def sig_handler(signal, frame):
     pass
 
+def logger_metrics(receiver, dispatch_table, logger, sock=None, pipeline=None):
+    """return the registry of the metrics of the logger"""
+    registry = MetricsRegistry()
+    registry.counter("datagrams_received_total", "datagrams received",
+                     lambda: receiver.packets)
+    registry.counter("bytes_received_total", "bytes received",
+                     lambda: receiver.bytes)
+    def failures():
+        failures = list(dispatch_table.failures)
+        if pipeline: # the log messages are decoded by the workers
+            failures = [count + worker_count for count, worker_count
+                        in zip(failures, pipeline.failures())]
+        return dict((m_type, count) for m_type, count in enumerate(failures) if count)
+    def unknown_subtypes():
+        unknown = dict((entry_type, table.unknown) for entry_type, table in subtypes.iteritems())
+        if pipeline:
+            for entry_type, count in pipeline.unknown_subtypes().iteritems():
+                unknown[entry_type] += count
+        return unknown
+    registry.counter("parse_failures_total", "messages that could not be decoded",
+                     failures, label="m_type")
+    registry.counter("unknown_subtypes_total", "log entries of an unknown sub-type",
+                     unknown_subtypes, label="entry_type")
+    if sock:
+        registry.counter("kernel_drops_total", "datagrams dropped by the kernel",
+                         lambda: kernel_drops(sock))
+        registry.gauge("socket_queue_bytes", "bytes waiting in the socket receive buffer",
+                       lambda: receive_queue(sock))
+    if pipeline:
+        registry.gauge("worker_queue_bytes", "bytes waiting to be handled by each worker",
+                       lambda: dict(enumerate(pipeline.queue_depths())), label="worker")
+    else:
+        registry.gauge("buffered_bytes", "bytes of lines waiting to be written",
+                       lambda: logger.pending_size)
+        registry.histogram("write_duration_seconds", "time taken to write a log entry",
+                           logger.write_duration)
+        registry.histogram("receive_to_write_seconds",
+                           "time between the reception of a log entry and its writing",
+                           logger.write_delay)
+    return registry
+
+def drops_report(sock):
+    print "kernel dropped %s datagrams" % kernel_drops(sock)
+
+def latency_report(latency):
+    print latency.report()
+    print latency.summary()
+
 if __name__ == "__main__":
     import argparse
     stdout = prettyfile(stdout)
     parser = argparse.ArgumentParser(usage= "log events coming from a wiredto154 simulation",
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-f", "--filename", help="output file", type=str, default=stdout)
+    parser.add_argument("-B", "--binary", help="also record the raw messages in a binary log file", type=str, default=None)
+    parser.add_argument("-C", "--columnar", help="also store the events in a columnar file (Parquet if pyarrow is installed, raw columns in a directory otherwise)", type=str, default=None)
     parser.add_argument("-a", "--address", help="IP address of the multicast group", default="224.1.1.1")
     parser.add_argument("-p", "--port", help="port to listen on", type=int, default=10000)
+    parser.add_argument("-b", "--batch-size", help="maximum number of datagrams read per wake-up", type=int, default=64)
+    parser.add_argument("-r", "--rcvbuf", help="size of the socket receive buffer (in bytes, system default if unset)", type=int, default=None)
+    parser.add_argument("-k", "--kernel-timestamps", help="timestamp the messages when the kernel receives them rather than when they are read (Linux only)", action="store_true")
+    parser.add_argument("-s", "--stats-interval", help="interval between two reports of the kernel drop counter (and of the latencies) in verbose mode (in seconds)", type=float, default=10.)
+    parser.add_argument("-i", "--flush-interval", help="buffer the output and write it every FLUSH_INTERVAL seconds (unbuffered if unset)", type=float, default=None)
+    parser.add_argument("-z", "--flush-size", help="write the buffered output as soon as it reaches FLUSH_SIZE bytes", type=int, default=65536)
+    parser.add_argument("-x", "--index", help="write a time and node index of the output file (FILENAME.idx)", action="store_true")
+    parser.add_argument("-R", "--replay", help="replay a binary log instead of listening to the multicast group", type=str, default=None)
+    parser.add_argument("-S", "--speed", help="replay speed factor (0 replays as fast as possible)", type=float, default=1.)
+    parser.add_argument("-g", "--group", help="listen to a multicast group and write its events to FILENAME (can be repeated, --address, --port and --filename are then ignored, and only the output and socket options are supported)",
+                        nargs=3, metavar=("ADDRESS", "PORT", "FILENAME"), action="append", default=None)
+    parser.add_argument("-w", "--workers", help="parse and format the messages in WORKERS processes (--index and --columnar are not supported in this mode)", type=int, default=0)
+    parser.add_argument("-L", "--latency", help="measure the latency between the time the data frames are sent by the simulation and the time they are received, for each node", action="store_true")
+    parser.add_argument("-m", "--metrics", help="print a summary of the metrics of the logger every STATS_INTERVAL seconds, and serve them in the Prometheus text format on METRICS (HOST:PORT for HTTP or the path of a Unix socket) if set",
+                        nargs="?", const="", default=None)
+    parser.add_argument("-P", "--profile", help="time the stages of the processing (receive, parse, dispatch, write...) and write them to PROFILE as collapsed stacks, on exit and on SIGUSR1", type=str, default=None)
+    parser.add_argument("-I", "--profile-interval", help="time one batch of messages out of PROFILE_INTERVAL", type=int, default=100)
     parser.add_argument("-v", "--verbose", help="make this tool more verbose", action="store_true")
 
     args = parser.parse_args()
@@ -62,27 +128,172 @@ if __name__ == "__main__":
     # set the signal to end the process gracefully
     signal(SIGINT, sig_handler)
 
-    logger = TextLogger(args.filename)
+    if args.group:
+        if args.metrics is not None or args.profile or args.binary or args.columnar \
+           or args.index or args.workers or args.replay or args.latency:
+            parser.error("--binary, --columnar, --index, --workers, --replay, --latency, "
+                         "--metrics and --profile can not be used with --group")
+        daemon = MulticastDaemon()
+        for address, port, filename in args.group:
+            logger = TextLogger(filename, flush_interval=args.flush_interval,
+                                flush_size=args.flush_size)
+            daemon.add_group(Group(address, int(port), logger,
+                                   batch_size=args.batch_size, rcvbuf=args.rcvbuf,
+                                   kernel_timestamps=args.kernel_timestamps))
+
+        print "starting logger loop on %d groups (hit CTRL+C to exit)" % len(args.group)
+        daemon.run(report=(lambda daemon: PRINT(daemon.stats())) if args.verbose else None,
+                   report_interval=args.stats_interval)
+        daemon.close()
+        print daemon.stats()
+        print "program is exiting gracefully"
+        sys.exit(0)
+
+    index = None
+    if args.index:
+        if not isinstance(args.filename, str):
+            parser.error("an index can only be written for an output file")
+        index = LogIndexWriter(index_filename(args.filename))
+
+    if args.workers:
+        if args.index or args.columnar:
+            parser.error("--index and --columnar can not be used with --workers")
+        pipeline = logger = ShardedLogger(args.filename, args.workers)
+    else:
+        pipeline = None
+        logger = TextLogger(args.filename, flush_interval=args.flush_interval,
+                            flush_size=args.flush_size, index=index)
+        if args.metrics is not None:
+            logger.measure()
+    at_simulation_end(logger.close)
+    binary_logger = None
+    if args.binary:
+        binary_logger = BinaryLogger(args.binary)
+        at_simulation_end(binary_logger.close)
+    dispatch_table = DispatchTable()
+    if not pipeline: # workers parse the log messages themselves
+        dispatch_table.subscribe(logger.write, LOG_HEADER)
+    dispatch_table.subscribe(lambda entry: logger.flush(), SIM_END)
+    columnar = None
+    if args.columnar:
+        columnar = columnar_writer(args.columnar)
+        at_simulation_end(columnar.close)
+        dispatch_table.subscribe(columnar.write, LOG_HEADER)
+    latency = None
+    if args.latency:
+        # a replayed session is handled long after it was sent
+        latency = LatencyMonitor(processing=not args.replay)
+        dispatch_table.subscribe(latency.packet, OUTBOUND_FRAME)
+        at_simulation_end(lambda: latency_report(latency))
+    dispatch_table.subscribe(end_of_simulation, SIM_END)
 
-    sock = multicast_listener(args.address, args.port)
+    if args.replay:
+        sock = None
+        receiver = ReplaySource(args.replay, speed=args.speed or None,
+                                batch_size=args.batch_size)
+    else:
+        sock = multicast_listener(args.address, args.port, rcvbuf=args.rcvbuf)
+        receiver = BatchReceiver(sock, batch_size=args.batch_size,
+                                 kernel_timestamps=args.kernel_timestamps)
+        at_simulation_end(lambda: drops_report(sock))
+
+    metrics = None
+    metrics_server = None
+    if args.metrics is not None:
+        metrics = logger_metrics(receiver, dispatch_table, logger, sock, pipeline)
+        if args.metrics:
+            metrics_server = MetricsServer(metrics, args.metrics)
+
+    receive = receiver.receive
+    dispatch = dispatch_table.dispatch
+    write_binary = binary_logger.write if binary_logger else None
+    submit = pipeline.submit if pipeline else None
+    profiler = None
+    if args.profile:
+        profiler = StageProfiler("logger", args.profile, args.profile_interval)
+        profiler.instrument(dispatch_table)
+        receive = profiler.wrap("receive", receive)
+        dispatch = profiler.wrap("dispatch", dispatch)
+        if binary_logger:
+            write_binary = profiler.wrap("BinaryLogger.write", write_binary)
+        if pipeline:
+            submit = profiler.wrap("ShardedLogger.submit", submit)
+            pipeline.flush = profiler.wrap("ShardedLogger.flush", pipeline.flush)
+        else:
+            logger.format = profiler.wrap("TextLogger.format", logger.format)
+            # the lines are written by the flusher thread in buffered mode
+            if args.flush_interval:
+                logger.flush = profiler.wrap_always("TextLogger.flush", logger.flush)
+        profiler.install()
+        at_simulation_end(profiler.dump)
 
     print "starting logger loop (hit CTRL+C to exit)"
 
     processing = True
+    next_report = time.time() + args.stats_interval
+    # wait for the socket with a timeout so that the reports are printed when
+    # no datagram comes in (a socket timeout would also apply to the
+    # non-blocking reads of a batch)
+    wait_for_report = sock is not None and (args.verbose or latency or metrics)
 
     while processing:
+        if profiler:
+            profiler.sample()
         try:
             PRINT("waiting for a new multicast message")
-            data, addr = sock.recvfrom(65535)
-            if data:
-                PRINT("received %d bytes" % len(data))
+            if wait_for_report and \
+               not select.select([sock], [], [], max(next_report - time.time(), 0.))[0]:
+                datagrams = [] # the next report is due
             else:
-                processing = False
-        except socket.error:
+                datagrams = receive()
+        except (socket.error, select.error), e:
+            # a dump of the profile was requested
+            if e.args and e.args[0] == EINTR and profiler and profiler.dump_requested:
+                continue
             processing = False
             continue
 
-        dispatcher(data, logger)
+        # messages are timestamped when they are received, so that their
+        # time does not depend on how long they wait to be processed
+        for data, timestamp in zip(datagrams, receiver.timestamps):
+            if not data:
+                processing = False
+                break
+            PRINT("received %d bytes" % len(data))
+            if write_binary:
+                write_binary(data, timestamp)
+            if pipeline and ord(data[0]) == LOG_HEADER:
+                submit(data, timestamp)
+            else:
+                dispatch(data, timestamp)
+        if pipeline:
+            pipeline.flush()
+
+        if time.time() >= next_report:
+            if sock and args.verbose:
+                PRINT("kernel dropped %s datagrams so far" % kernel_drops(sock))
+            if latency:
+                PRINT(latency.summary())
+            if metrics:
+                print metrics.summary()
+            next_report = time.time() + args.stats_interval
 
+    if metrics_server:
+        metrics_server.close()
+    logger.close()
+    if binary_logger:
+        binary_logger.close()
+    if columnar:
+        columnar.close()
+    PRINT(receiver.stats())
+    if sock:
+        drops_report(sock)
+    if latency:
+        latency_report(latency)
+    if metrics:
+        print metrics.summary()
+    if profiler:
+        profiler.dump()
+        print "profile of %d batches written to %s" % (profiler.samples, args.profile)
     print "program is exiting gracefully"
 
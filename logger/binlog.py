@@ -0,0 +1,130 @@
+"""compact binary log of the simulation messages
+
+a binary log starts with a file header (magic string and format version)
+followed by records, each record being:
+- the size of the datagram (2 bytes)
+- the time the datagram was received (8 bytes, double, seconds since epoch)
+- message type, entry type and entry sub-type (1 byte each, entry type and
+  sub-type are 0 for messages that are not log messages)
+- the raw datagram
+
+all values are big endian"""
+import struct, time, mmap
+from collections import namedtuple
+from parser import LOG_HEADER
+from dispatch import DispatchTable
+
+MAGIC = "W154BIN"
+VERSION = 1
+
+file_header = struct.Struct("!7sB")
+record_header = struct.Struct("!HdBBB")
+message_header = struct.Struct("!BBB")
+
+Record = namedtuple("Record", ["timestamp", "m_type", "entry_type", "subtype", "data"])
+
+class BinaryLogError(Exception):
+    pass
+
+class BinaryLogger(object):
+    """write every received datagram, untouched, to a binary log
+
+    records are written through the file object buffer, close() (or flush())
+    must be called to make sure they reach the disk"""
+    fd = None
+    def __init__(self, filename):
+        self.fd = open(filename, mode='wb')
+        self.fd.write(file_header.pack(MAGIC, VERSION))
+
+    def write(self, data, timestamp=None):
+        """log a datagram, timestamp is the time the datagram was received
+        (now if unset)"""
+        if timestamp is None:
+            timestamp = time.time()
+        m_type = ord(data[0]) if len(data) else 0
+        if m_type == LOG_HEADER and len(data) >= message_header.size:
+            m_type, entry_type, subtype = message_header.unpack_from(data)
+        else:
+            entry_type, subtype = 0, 0
+        self.fd.write(record_header.pack(len(data), timestamp, m_type, entry_type, subtype))
+        self.fd.write(data)
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self):
+        if not self.fd.closed: # also called on a simulation end
+            self.fd.flush()
+            self.fd.close()
+
+class BinaryLogReader(object):
+    """iterate over the records of a binary log
+
+    records are read lazily from the file, or from a memory mapping of the
+    whole file when use_mmap is set (faster on large logs)"""
+    def __init__(self, filename, use_mmap=False):
+        self.filename = filename
+        self.use_mmap = use_mmap
+
+    def __iter__(self):
+        with open(self.filename, mode='rb') as fd:
+            check_file_header(fd, self.filename)
+            if self.use_mmap:
+                records = self.read_mmap(fd)
+            else:
+                records = self.read_file(fd)
+            for record in records:
+                yield record
+
+    def read_file(self, fd):
+        header_size = record_header.size
+        while True:
+            header = fd.read(header_size)
+            if len(header) < header_size: # end of file (or truncated record)
+                return
+            size, timestamp, m_type, entry_type, subtype = record_header.unpack(header)
+            data = fd.read(size)
+            if len(data) < size:
+                return
+            yield Record(timestamp, m_type, entry_type, subtype, data)
+
+    def read_mmap(self, fd):
+        # mmap does not handle empty files
+        fd.seek(0, 2)
+        if fd.tell() == file_header.size:
+            return
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            unpack_from = record_header.unpack_from
+            header_size = record_header.size
+            offset = file_header.size
+            end = len(mm)
+            while offset + header_size <= end:
+                size, timestamp, m_type, entry_type, subtype = unpack_from(mm, offset)
+                offset += header_size
+                if offset + size > end:
+                    return
+                yield Record(timestamp, m_type, entry_type, subtype, mm[offset:offset + size])
+                offset += size
+        finally:
+            mm.close()
+
+def check_file_header(fd, filename):
+    """read the file header of a binary log or raise a BinaryLogError"""
+    header = fd.read(file_header.size)
+    if len(header) < file_header.size:
+        raise BinaryLogError("%s is not a binary log" % filename)
+    magic, version = file_header.unpack(header)
+    if magic != MAGIC:
+        raise BinaryLogError("%s is not a binary log" % filename)
+    if version != VERSION:
+        raise BinaryLogError("unsupported binary log version %d" % version)
+
+def convert_to_text(reader, logger):
+    """write the log messages of a binary log to a TextLogger, as if they
+    had been received live"""
+    table = DispatchTable()
+    table.subscribe(logger.write, LOG_HEADER)
+    for record in reader:
+        table.dispatch(record.data, record.timestamp)
+    logger.close()
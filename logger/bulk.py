@@ -0,0 +1,168 @@
+"""bulk decoding of the data frames of a binary log into NumPy arrays
+
+this module requires NumPy (e.g. pip install numpy)"""
+import mmap
+import numpy as np
+from binlog import check_file_header, file_header, record_header
+from framer import decode_frame_control, FrameError
+from parser import OUTBOUND_FRAME
+
+AKM_PAYLOAD = 0x47
+# offset of the message type and of the receive time in a record header
+RECORD_M_TYPE = 10
+RECORD_TIME = 2
+
+def record_offsets(data):
+    """return the offsets of the records of a binary log (only the record
+    headers are read)"""
+    offsets = []
+    append = offsets.append
+    unpack_from = record_header.unpack_from
+    header_size = record_header.size
+    offset = file_header.size
+    end = len(data)
+    while offset + header_size <= end:
+        size = unpack_from(data, offset)[0]
+        if offset + header_size + size > end: # truncated record
+            break
+        append(offset)
+        offset += header_size + size
+    return np.array(offsets, dtype=np.int64)
+
+def gather_u16(data, positions):
+    """read big endian 16 bits integers at positions"""
+    return (data[positions].astype(np.int64) << 8) | data[positions + 1]
+
+def gather(data, positions, size, dtype):
+    """read values of size bytes (of type dtype) at positions"""
+    return data[positions[:, None] + np.arange(size)].copy().view(dtype).ravel()
+
+def gather_lists(data, starts, counts):
+    """read lists of big endian 16 bits integers, return the flattened lists
+    and the offset of each list in the flattened array"""
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    total = offsets[-1]
+    positions = np.repeat(starts - 2 * offsets[:-1], counts) + 2 * np.arange(total)
+    return gather_u16(data, positions), offsets
+
+def payload_offsets(fc):
+    """return the MAC payload offset of each frame control word (-1 for
+    reserved values)"""
+    words, inverse = np.unique(fc, return_inverse=True)
+    table = np.empty(len(words), dtype=np.int64)
+    for i, word in enumerate(words):
+        try:
+            table[i] = decode_frame_control(int(word)).payload_offset
+        except FrameError:
+            table[i] = -1
+    return table[inverse]
+
+class FrameColumns(object):
+    """data frames of a binary log, stored column wise
+
+    each column holds one value per frame: node (the sender), time (receive
+    time, in seconds since the epoch), sim_timestamp (8 bytes timestamp set by
+    the simulation, as an unsigned integer), num_good/num_bad (number of nodes
+    that received the frame or not), fc (frame control word) and the fields
+    derived from it, payload_type (first byte of the MAC payload, -1 if the
+    frame could not be decoded)
+
+    good_nodes (resp. bad_nodes) is the concatenation of the lists of good
+    (resp. bad) nodes, the list of frame i being
+    good_nodes[good_offsets[i]:good_offsets[i + 1]]"""
+    def __init__(self, data):
+        """data is a binary log (a string or a memory mapping of the file)"""
+        buf = np.frombuffer(data, dtype=np.uint8)
+        offsets = record_offsets(data)
+        sizes = gather_u16(buf, offsets)
+        # message type is recorded in the record header, the message must at
+        # least contain the node and the number of good nodes
+        is_frame = (buf[offsets + RECORD_M_TYPE] == OUTBOUND_FRAME) & (sizes >= 5)
+        offsets, sizes = offsets[is_frame], sizes[is_frame]
+        starts = offsets + record_header.size # start of the messages
+        ends = starts + sizes
+
+        # drop the messages that are too short for their content, checking the
+        # fields in order (the next position depends on the previous field)
+        num_good = gather_u16(buf, starts + 3)
+        valid = starts + 7 + 2 * num_good <= ends
+        bad_count_pos = np.where(valid, starts + 5 + 2 * num_good, starts)
+        num_bad = np.where(valid, gather_u16(buf, bad_count_pos), 0)
+        frame_starts = bad_count_pos + 2 + 2 * num_bad + 8
+        valid &= frame_starts + 2 <= ends
+
+        offsets, starts, ends = offsets[valid], starts[valid], ends[valid]
+        num_good, num_bad = num_good[valid], num_bad[valid]
+        frame_starts = frame_starts[valid]
+
+        self.count = len(offsets)
+        self.node = gather_u16(buf, starts + 1)
+        self.time = gather(buf, offsets + RECORD_TIME, 8, ">f8")
+        self.num_good = num_good
+        self.num_bad = num_bad
+        self.good_nodes, self.good_offsets = gather_lists(buf, starts + 5, num_good)
+        bad_starts = starts + 7 + 2 * num_good
+        self.bad_nodes, self.bad_offsets = gather_lists(buf, bad_starts, num_bad)
+        self.sim_timestamp = gather(buf, frame_starts - 8, 8, ">u8")
+        self.frame_length = ends - frame_starts
+
+        # frame control is little endian
+        fc = buf[frame_starts].astype(np.int64) | (buf[frame_starts + 1].astype(np.int64) << 8)
+        self.fc = fc
+        self.frame_type = fc & 0x0007
+        self.security_enabled = (fc & 0x0008) != 0
+        self.ack_requested = (fc & 0x0020) != 0
+        self.pan_id_compressed = (fc & 0x0040) != 0
+        self.dst_addr_mode = (fc & 0x0c00) >> 10
+        self.frame_version = (fc & 0x3000) >> 12
+        self.src_addr_mode = (fc & 0xc000) >> 14
+
+        payload_offset = payload_offsets(fc) if self.count else np.zeros(0, np.int64)
+        has_payload = (payload_offset >= 0) & (payload_offset < self.frame_length)
+        self.payload_type = np.full(self.count, -1, dtype=np.int64)
+        self.payload_type[has_payload] = buf[frame_starts[has_payload] +
+                                             payload_offset[has_payload]]
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename, mode='rb') as fd:
+            check_file_header(fd, filename)
+            fd.seek(0, 2)
+            if fd.tell() == file_header.size: # mmap does not handle empty files
+                return cls(fd.read())
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return cls(mm)
+            finally:
+                # arrays are copies, the mapping is not needed anymore
+                mm.close()
+
+    def nodes(self):
+        """return the identifiers of the nodes that sent frames"""
+        return np.unique(self.node)
+
+    def transmit_counts(self):
+        """return the number of frames sent by each node (indexed by node)"""
+        return np.bincount(self.node, minlength=self.node.max() + 1 if self.count else 0)
+
+    def fanout(self):
+        """return the total number of good and bad receivers of the frames
+        sent by each node (indexed by node)"""
+        length = self.node.max() + 1 if self.count else 0
+        return (np.bincount(self.node, weights=self.num_good, minlength=length),
+                np.bincount(self.node, weights=self.num_bad, minlength=length))
+
+    def akm_counts(self):
+        """return the number of AKM frames and of other frames sent by each
+        node (indexed by node)"""
+        length = self.node.max() + 1 if self.count else 0
+        is_akm = self.payload_type == AKM_PAYLOAD
+        return (np.bincount(self.node[is_akm], minlength=length),
+                np.bincount(self.node[~is_akm], minlength=length))
+
+    def frame_nodes(self, i, bad=False):
+        """return the good (or bad) nodes of frame i"""
+        if bad:
+            return self.bad_nodes[self.bad_offsets[i]:self.bad_offsets[i + 1]]
+        return self.good_nodes[self.good_offsets[i]:self.good_offsets[i + 1]]
@@ -0,0 +1,334 @@
+"""columnar storage of the log events, for analysis tools (e.g. pandas)
+
+events are written in chunks of rows, with the following columns:
+- time: time the event was received, in seconds since the first event
+- type: entry type (0 if unknown)
+- subtype: entry sub-type
+- nodes: nodes involved in the event
+- data: data of the event
+
+when pyarrow is installed, events are stored in a Parquet file (one row group
+per chunk), otherwise they are stored in a directory holding one raw file
+per column (little endian) and a description of the columns (meta.json).
+Variable length columns (nodes and data) are stored flattened along with the
+offset following the values of each row (node_ends and data_ends), so that
+all columns can be memory mapped with NumPy."""
+import json, os, re, sys, time
+from array import array
+from parser import subtypes, TextLogger, LOG_HEADER, UNKNOWN_LABEL
+from dispatch import DispatchTable
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+# raw columns and their NumPy types (offsets are stored as unsigned longs,
+# whose size depends on the platform)
+OFFSET_DTYPE = "<u%d" % array('L').itemsize
+raw_columns = [("time", "<f8"),
+               ("type", "u1"),
+               ("subtype", "u1"),
+               ("node_ends", OFFSET_DTYPE),
+               ("nodes", "<u2"),
+               ("data_ends", OFFSET_DTYPE),
+               ("data", "u1")]
+
+class ColumnarWriter(object):
+    """accumulate events and write them in chunks of chunk_size rows
+
+    this class only holds the rows of the current chunk, the writers of each
+    storage layout define flush(), which writes the current chunk and starts
+    a new one. write() has the same interface as TextLogger.write(), so that
+    a ColumnarWriter can be used as a live sink"""
+    def __init__(self, path, chunk_size=65536):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.start_time = None
+        self.rows = 0
+        self.chunks = []
+        self.new_chunk()
+
+    def elapsed(self, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if not self.start_time:
+            self.start_time = timestamp
+        return timestamp - self.start_time
+
+    def write(self, log, timestamp=None):
+        if timestamp is None:
+            timestamp = log.get('time')
+        self.add(self.elapsed(timestamp), log['type'], log['subtype'],
+                 log['nodes'], log['data'])
+
+    def add(self, elapsed, entry_type, subtype, nodes, data):
+        self.time.append(elapsed)
+        self.type.append(entry_type)
+        self.subtype.append(subtype)
+        self.nodes.extend(nodes)
+        self.data.append(data)
+        if len(self.time) >= self.chunk_size:
+            self.flush()
+
+    def new_chunk(self):
+        self.time = array('d')
+        self.type = array('B')
+        self.subtype = array('B')
+        self.nodes = array('H')
+        self.data = []
+
+    def close(self):
+        if len(self.time):
+            self.flush()
+
+class RawColumnarWriter(ColumnarWriter):
+    """store the columns in raw files, in a directory"""
+    def __init__(self, path, chunk_size=65536):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.files = dict((name, open(os.path.join(path, name), mode='wb'))
+                          for name, dtype in raw_columns)
+        self.node_count = 0 # number of nodes and bytes of data written so far
+        self.data_size = 0
+        super(RawColumnarWriter, self).__init__(path, chunk_size)
+        self.write_meta()
+
+    def add(self, elapsed, entry_type, subtype, nodes, data):
+        self.node_count += len(nodes)
+        self.data_size += len(data)
+        self.node_ends.append(self.node_count)
+        self.data_ends.append(self.data_size)
+        super(RawColumnarWriter, self).add(elapsed, entry_type, subtype, nodes, data)
+
+    def new_chunk(self):
+        super(RawColumnarWriter, self).new_chunk()
+        self.node_ends = array('L')
+        self.data_ends = array('L')
+
+    def flush(self):
+        columns = {"time": self.time, "type": self.type, "subtype": self.subtype,
+                   "node_ends": self.node_ends, "nodes": self.nodes,
+                   "data_ends": self.data_ends}
+        for name, values in columns.iteritems():
+            if sys.byteorder != "little":
+                values.byteswap()
+            values.tofile(self.files[name])
+        self.files["data"].write("".join(self.data))
+        for fd in self.files.itervalues():
+            fd.flush()
+        self.chunks.append(len(self.time))
+        self.rows += len(self.time)
+        self.new_chunk()
+        self.write_meta()
+
+    def write_meta(self):
+        meta = {"version": FORMAT_VERSION,
+                "start_time": self.start_time,
+                "rows": self.rows,
+                "chunks": self.chunks,
+                "columns": dict((name, dtype) for name, dtype in raw_columns)}
+        # the description is replaced atomically, so that readers never
+        # see a partial file
+        filename = os.path.join(self.path, META_FILE)
+        with open(filename + ".tmp", mode='w') as fd:
+            json.dump(meta, fd)
+        os.rename(filename + ".tmp", filename)
+
+    def close(self):
+        super(RawColumnarWriter, self).close()
+        for fd in self.files.itervalues():
+            fd.close()
+
+class ParquetWriter(ColumnarWriter):
+    """store the events in a Parquet file, one row group per chunk"""
+    def __init__(self, path, chunk_size=65536):
+        super(ParquetWriter, self).__init__(path, chunk_size)
+        self.schema = pyarrow.schema([("time", pyarrow.float64()),
+                                      ("type", pyarrow.uint8()),
+                                      ("subtype", pyarrow.uint8()),
+                                      ("nodes", pyarrow.list_(pyarrow.uint16())),
+                                      ("data", pyarrow.binary())])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def add(self, elapsed, entry_type, subtype, nodes, data):
+        self.node_lists.append(nodes)
+        super(ParquetWriter, self).add(elapsed, entry_type, subtype, nodes, data)
+
+    def new_chunk(self):
+        super(ParquetWriter, self).new_chunk()
+        self.node_lists = []
+
+    def flush(self):
+        table = pyarrow.Table.from_arrays(
+                [pyarrow.array(self.time, type=pyarrow.float64()),
+                 pyarrow.array(self.type, type=pyarrow.uint8()),
+                 pyarrow.array(self.subtype, type=pyarrow.uint8()),
+                 pyarrow.array(self.node_lists, type=pyarrow.list_(pyarrow.uint16())),
+                 pyarrow.array(self.data, type=pyarrow.binary())],
+                schema=self.schema)
+        self.writer.write_table(table)
+        self.chunks.append(len(self.time))
+        self.rows += len(self.time)
+        self.new_chunk()
+
+    def close(self):
+        super(ParquetWriter, self).close()
+        self.writer.close()
+
+def columnar_writer(path, chunk_size=65536, parquet=None):
+    """return a ColumnarWriter writing to path, in the Parquet format if
+    parquet is set (or if pyarrow is installed and parquet is None)"""
+    if parquet is None:
+        parquet = pyarrow is not None
+    if parquet:
+        if pyarrow is None:
+            raise ImportError("writing Parquet files requires pyarrow")
+        return ParquetWriter(path, chunk_size)
+    return RawColumnarWriter(path, chunk_size)
+
+class EventColumns(object):
+    """events loaded from a columnar store, as NumPy arrays
+
+    nodes (resp. data) holds the nodes (resp. the data) of all the events, those
+    of event i being nodes[node_offsets[i]:node_offsets[i + 1]]"""
+    def __init__(self, time, type, subtype, nodes, node_offsets, data, data_offsets):
+        self.time = time
+        self.type = type
+        self.subtype = subtype
+        self.nodes = nodes
+        self.node_offsets = node_offsets
+        self.data = data
+        self.data_offsets = data_offsets
+
+    def __len__(self):
+        return len(self.time)
+
+    def event_nodes(self, i):
+        return self.nodes[self.node_offsets[i]:self.node_offsets[i + 1]]
+
+    def event_data(self, i):
+        return self.data[self.data_offsets[i]:self.data_offsets[i + 1]].tostring()
+
+    def to_dataframe(self):
+        """return a pandas DataFrame of the events (requires pandas)"""
+        import pandas
+        return pandas.DataFrame({"time": self.time,
+                                 "type": self.type,
+                                 "subtype": self.subtype,
+                                 "nodes": [self.event_nodes(i) for i in xrange(len(self))],
+                                 "data": [self.event_data(i) for i in xrange(len(self))]},
+                                columns=["time", "type", "subtype", "nodes", "data"])
+
+def load_events(path):
+    """load a columnar store (requires NumPy), raw columns are memory mapped"""
+    if not os.path.isdir(path):
+        return load_parquet(path)
+
+    import numpy as np
+    with open(os.path.join(path, META_FILE)) as fd:
+        meta = json.load(fd)
+    rows = meta["rows"]
+    dtypes = meta["columns"]
+
+    def column(name, count):
+        # only map what the description covers (the writer may be running)
+        if count == 0:
+            return np.zeros(0, dtype=dtypes[name])
+        return np.memmap(os.path.join(path, name), dtype=dtypes[name], mode='r',
+                         shape=(count,))
+
+    node_ends = column("node_ends", rows)
+    data_ends = column("data_ends", rows)
+    zero = np.zeros(1, dtype=node_ends.dtype)
+    return EventColumns(column("time", rows), column("type", rows), column("subtype", rows),
+                        column("nodes", int(node_ends[-1]) if rows else 0),
+                        np.concatenate([zero, node_ends]),
+                        column("data", int(data_ends[-1]) if rows else 0),
+                        np.concatenate([zero, data_ends]))
+
+def load_parquet(path):
+    """load a Parquet file written by ParquetWriter"""
+    import numpy as np
+    if pyarrow is None:
+        raise ImportError("reading Parquet files requires pyarrow")
+    table = pyarrow.parquet.read_table(path, memory_map=True)
+
+    def column(name, dtype):
+        chunks = [chunk.to_numpy() for chunk in table.column(name).chunks]
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+
+    def flatten(name, dtype):
+        """return the values of a list (or binary) column and the number of
+        values of each row"""
+        values, counts = [], []
+        for chunk in table.column(name).chunks:
+            offsets = np.frombuffer(chunk.buffers()[1], dtype="<i4")
+            offsets = offsets[chunk.offset:chunk.offset + len(chunk) + 1]
+            counts.append(np.diff(offsets))
+            if name == "data":
+                data = chunk.buffers()[2]
+                data = np.frombuffer(data, dtype=dtype) if data else np.zeros(0, dtype)
+                values.append(data[offsets[0]:offsets[-1]])
+            else:
+                values.append(chunk.flatten().to_numpy())
+        if not counts:
+            return np.zeros(0, dtype=dtype), offsets_of([])
+        return np.concatenate(values), offsets_of(np.concatenate(counts))
+
+    nodes, node_offsets = flatten("nodes", "<u2")
+    data, data_offsets = flatten("data", "u1")
+    return EventColumns(column("time", "<f8"), column("type", "u1"), column("subtype", "u1"),
+                        nodes, node_offsets, data, data_offsets)
+
+def offsets_of(counts):
+    """return the offsets of the rows of a flattened column, given the
+    number of values of each row"""
+    import numpy as np
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+def export_binary(reader, writer):
+    """write the log messages of a binary log to a ColumnarWriter"""
+    table = DispatchTable()
+    table.subscribe(writer.write, LOG_HEADER)
+    for record in reader:
+        table.dispatch(record.data, record.timestamp)
+    writer.close()
+
+def export_text(filename, writer):
+    """write the events of a text log to a ColumnarWriter, return the number
+    of lines skipped (not written by TextLogger)"""
+    # subtype name (as written by TextLogger) to entry type and sub-type
+    names = {}
+    for entry_type, entry_subtypes in subtypes.iteritems():
+        for subtype, label in entry_subtypes.iteritems():
+            names[TextLogger.compact_subtypename(label)] = (entry_type, subtype)
+    unknown = re.compile(re.escape(TextLogger.compact_subtypename(UNKNOWN_LABEL)) + r"(\d+)$")
+    skipped = 0
+    with open(filename) as fd:
+        for line in fd:
+            try:
+                elapsed, name, rest = line.split(None, 2)
+                if name in names:
+                    entry_type, subtype = names[name]
+                else:
+                    match = unknown.match(name)
+                    if match is None:
+                        raise ValueError("unknown sub-type %s" % name)
+                    entry_type, subtype = 0, int(match.group(1))
+                nodes = rest[rest.index("[") + 1:rest.index("]")]
+                nodes = [int(node) for node in nodes.split(",") if node.strip()]
+                data = rest[rest.index("(") + 1:rest.rindex(")")]
+                elapsed = float(elapsed)
+            except ValueError:
+                skipped += 1
+                continue
+            writer.add(elapsed, entry_type, subtype, nodes, data)
+    writer.close()
+    return skipped
@@ -0,0 +1,115 @@
+"""event loop listening to several multicast groups in a single process"""
+import select, socket, time
+from errno import EAGAIN, EWOULDBLOCK, EINTR
+from network import multicast_listener, kernel_drops, BatchReceiver
+from parser import LOG_HEADER, SIM_END
+from dispatch import DispatchTable
+
+class Group(object):
+    """a multicast group and the sink (e.g. a TextLogger) its events are
+    written to"""
+    def __init__(self, address, port, sink, batch_size=64, rcvbuf=None,
+                 kernel_timestamps=False):
+        self.address = address
+        self.port = port
+        self.sink = sink
+        self.sock = multicast_listener(address, port, rcvbuf=rcvbuf, bind_group=True)
+        if not self.sock:
+            raise ValueError("%s is not a valid IP address" % address)
+        self.sock.setblocking(False)
+        self.receiver = BatchReceiver(self.sock, batch_size=batch_size,
+                                      kernel_timestamps=kernel_timestamps)
+        self.dispatch_table = DispatchTable()
+        self.dispatch_table.subscribe(sink.write, LOG_HEADER)
+        self.dispatch_table.subscribe(self.end, SIM_END)
+        self.ended = False
+        self.datagrams = 0
+        self.bytes = 0
+        self.drops = None # kernel drops, once the socket is closed
+
+    def __str__(self):
+        return "[%s]:%d" % (self.address, self.port)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def process(self):
+        """read and dispatch the datagrams queued on the socket"""
+        try:
+            datagrams = self.receiver.receive()
+        except socket.error, e:
+            if e.errno in (EAGAIN, EWOULDBLOCK): # spurious wake-up
+                return
+            raise
+        dispatch = self.dispatch_table.dispatch
+        for data, timestamp in zip(datagrams, self.receiver.timestamps):
+            self.datagrams += 1
+            self.bytes += len(data)
+            dispatch(data, timestamp)
+
+    def end(self, entry):
+        """handler for the simulation end message"""
+        print "received simulation end message on group %s" % self
+        self.ended = True
+
+    def close(self):
+        self.sink.close()
+        self.drops = kernel_drops(self.sock)
+        self.sock.close()
+        self.sock = None
+
+    def stats(self):
+        """return a one-line summary of the group statistics"""
+        drops = kernel_drops(self.sock) if self.sock else self.drops
+        return "group %s: %d datagrams (%d bytes), kernel dropped %s datagrams" % \
+                (self, self.datagrams, self.bytes, drops)
+
+class MulticastDaemon(object):
+    """wait for datagrams on all the groups at once and hand them to the
+    group they were sent to
+
+    a group is closed when its simulation ends, the daemon stops when all the
+    groups are closed (or when interrupted by a signal)"""
+    def __init__(self):
+        self.groups = {} # indexed by file descriptor
+        self.closed = []
+        self.poller = select.poll()
+
+    def add_group(self, group):
+        self.groups[group.fileno()] = group
+        self.poller.register(group.fileno(), select.POLLIN)
+
+    def close_group(self, group):
+        self.poller.unregister(group.fileno())
+        del self.groups[group.fileno()]
+        self.closed.append(group)
+        group.close()
+
+    def run(self, report=None, report_interval=10.):
+        """process datagrams until all the groups are closed, report is called
+        every report_interval seconds (when set)"""
+        timeout = int(report_interval * 1000) if report else None
+        next_report = time.time() + report_interval
+        while self.groups:
+            try:
+                events = self.poller.poll(timeout)
+            except select.error, e:
+                if e.args[0] == EINTR: # e.g. SIGINT
+                    break
+                raise
+            for fd, event in events:
+                group = self.groups[fd]
+                group.process()
+                if group.ended:
+                    self.close_group(group)
+            if report and time.time() >= next_report:
+                report(self)
+                next_report = time.time() + report_interval
+
+    def close(self):
+        for group in self.groups.values():
+            self.close_group(group)
+
+    def stats(self):
+        """return the statistics of each group (one line per group)"""
+        return "\n".join([group.stats() for group in self.groups.values() + self.closed])
@@ -0,0 +1,109 @@
+"""table driven dispatch of simulation messages to their parser and handlers"""
+import struct
+from array import array
+from parser import OUTBOUND_FRAME, LOG_HEADER, SIM_END, \
+                   TYPE_ONENODE, TYPE_TWONODES, TYPE_MANYNODES, \
+                   Packet, parse_packet, parse_onenode, parse_twonodes, parse_manynodes
+from tools import PRINT
+
+# (message type, entry type, parser, offset of the parsed data, minimum length)
+# entry type is None for messages that do not carry an entry type
+default_routes = [(LOG_HEADER, TYPE_ONENODE, parse_onenode, 2, 5),
+                  (LOG_HEADER, TYPE_TWONODES, parse_twonodes, 2, 5),
+                  (LOG_HEADER, TYPE_MANYNODES, parse_manynodes, 2, 5),
+                  (OUTBOUND_FRAME, None, parse_packet, 1, 5),
+                  (SIM_END, None, None, 1, 1)]
+
+class Route(object):
+    """parser and handlers associated to a message type (and entry type)"""
+    __slots__ = ('entry_type', 'parser', 'offset', 'min_length', 'handlers')
+    def __init__(self, entry_type, parser, offset, min_length):
+        self.entry_type = entry_type
+        self.parser = parser
+        self.offset = offset
+        self.min_length = min_length
+        self.handlers = []
+
+class DispatchTable(object):
+    """decode each message once and hand the result to all the handlers
+    subscribed to its type
+
+    the route of a message is found in a table indexed by its message type and
+    entry type (or None when the message type does not carry an entry type)
+
+    failures counts, for each message type, the messages that could not be
+    decoded (unknown type, too short or malformed)"""
+    def __init__(self, routes=default_routes):
+        self.table = {}
+        self.failures = array('L', [0]) * 256
+        # message types that carry an entry type
+        self.keyed_types = set()
+        # handlers subscribed to all the entry types of a message type
+        self.wildcards = {}
+        for route in routes:
+            self.register(*route)
+
+    def register(self, m_type, entry_type, parser, offset, min_length=1):
+        """register the parser of a new type of message, parser is called
+        with the message and the offset of the data to parse and returns a
+        dictionary (or None if the message carries no data)"""
+        route = Route(entry_type, parser, offset, min_length)
+        route.handlers.extend(self.wildcards.get(m_type, []))
+        self.table[(m_type, entry_type)] = route
+        if entry_type is not None:
+            self.keyed_types.add(m_type)
+
+    def subscribe(self, handler, m_type, entry_type=None):
+        """call handler with the parsed content of every message of type
+        m_type, entry_type restricts the subscription to a single entry type"""
+        if entry_type is None:
+            self.wildcards.setdefault(m_type, []).append(handler)
+            for (route_m_type, route_entry_type), route in self.table.iteritems():
+                if route_m_type == m_type:
+                    route.handlers.append(handler)
+        else:
+            self.table[(m_type, entry_type)].handlers.append(handler)
+
+    def dispatch(self, data, timestamp=None):
+        """decode a message and hand it to its handlers, timestamp (the time
+        the message was received) is stored in the 'time' field of log
+        entries and in the time attribute of packets"""
+        try:
+            m_type = ord(data[0])
+        except IndexError: # empty message
+            return
+        try:
+            key = (m_type, ord(data[1]) if m_type in self.keyed_types else None)
+            route = self.table[key]
+        except IndexError: # message is too short
+            self.failures[m_type] += 1
+            return
+        except KeyError:
+            self.failures[m_type] += 1
+            PRINT("message type %d (entry type %s) is not recognized" % key)
+            return
+
+        # nobody is interested in this message, do not bother decoding it
+        if not route.handlers:
+            return
+        if len(data) < route.min_length:
+            self.failures[m_type] += 1
+            return
+
+        if route.parser:
+            try:
+                entry = route.parser(data, route.offset)
+            except struct.error:
+                self.failures[m_type] += 1
+                PRINT("could not parse message of type %d" % m_type)
+                return
+            if route.entry_type is not None:
+                entry['type'] = route.entry_type
+                entry['time'] = timestamp
+            elif type(entry) is Packet:
+                entry.time = timestamp
+        else:
+            entry = None
+
+        for handler in route.handlers:
+            handler(entry)
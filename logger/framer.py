@@ -1,6 +1,93 @@
 """parser for IEEE 802.15.4 frames"""
 import struct
-import struct
+from collections import namedtuple
+
+frame_control_format = struct.Struct("<H")
+byte_format = struct.Struct("B")
+# PAN IDs and addresses, indexed by their size
+field_formats = {2: struct.Struct("<H"), 8: struct.Struct("<Q")}
+
+# size of the addresses, indexed by addressing mode (None for reserved modes)
+addr_sizes = [0, None, 2, 8]
+
+class FrameError(Exception):
+    """the frame is too short or its frame control field uses reserved values"""
+    pass
+
+FrameControl = namedtuple("FrameControl", ["frame_type", "security_enabled",
+                                           "frame_pending", "ack_requested",
+                                           "pan_id_compressed", "dst_addr_mode",
+                                           "frame_version", "src_addr_mode",
+                                           "dst_addr_size", "src_addr_size",
+                                           "dst_panid_present", "src_panid_present",
+                                           "dst_addr_offset", "src_panid_offset",
+                                           "src_addr_offset", "payload_offset"])
+
+def decode_frame_control(fc):
+    """decode all the fields of a frame control word (and what can be derived
+    from them), use the frame_controls table rather than calling this
+    function directly"""
+    dst_addr_mode = (fc & 0x0c00) >> 10
+    src_addr_mode = (fc & 0xc000) >> 14
+    pan_id_compressed = (fc & 0x0040) == 0x0040
+    dst_addr_size = addr_sizes[dst_addr_mode]
+    src_addr_size = addr_sizes[src_addr_mode]
+    if dst_addr_size is None:
+        raise FrameError("destination addressing mode %d is reserved" % dst_addr_mode)
+    if src_addr_size is None:
+        raise FrameError("source addressing mode %d is reserved" % src_addr_mode)
+
+    if src_addr_size and dst_addr_size:
+        dst_panid_present, src_panid_present = True, not pan_id_compressed
+    elif src_addr_size or dst_addr_size:
+        if pan_id_compressed:
+            raise FrameError("PAN ID compression requires both addresses")
+        dst_panid_present, src_panid_present = bool(dst_addr_size), bool(src_addr_size)
+    else:
+        dst_panid_present, src_panid_present = False, False
+
+    # frame control (2 bytes) and sequence number (1 byte), followed by
+    # the destination PAN ID and address and the source PAN ID and address
+    dst_addr_offset = 3 + (2 if dst_panid_present else 0)
+    src_panid_offset = dst_addr_offset + dst_addr_size
+    src_addr_offset = src_panid_offset + (2 if src_panid_present else 0)
+    payload_offset = src_addr_offset + src_addr_size
+
+    return FrameControl(frame_type=fc & 0x0007,
+                        security_enabled=(fc & 0x0008) == 0x0008,
+                        frame_pending=(fc & 0x0010) == 0x0010,
+                        ack_requested=(fc & 0x0020) == 0x0020,
+                        pan_id_compressed=pan_id_compressed,
+                        dst_addr_mode=dst_addr_mode,
+                        frame_version=(fc & 0x3000) >> 12,
+                        src_addr_mode=src_addr_mode,
+                        dst_addr_size=dst_addr_size,
+                        src_addr_size=src_addr_size,
+                        dst_panid_present=dst_panid_present,
+                        src_panid_present=src_panid_present,
+                        dst_addr_offset=dst_addr_offset,
+                        src_panid_offset=src_panid_offset,
+                        src_addr_offset=src_addr_offset,
+                        payload_offset=payload_offset)
+
+class FrameControlTable(dict):
+    """decoded frame control words, filled as new words are seen
+    (invalid words are not stored and raise a FrameError on each lookup)"""
+    def __missing__(self, fc):
+        value = self[fc] = decode_frame_control(fc)
+        return value
+
+frame_controls = FrameControlTable()
+
+def frame_control(frame):
+    """return the decoded frame control of a frame"""
+    if len(frame) < 3:
+        raise FrameError("frame is too short (%d bytes)" % len(frame))
+    return frame_controls[frame_control_format.unpack_from(frame)[0]]
+
+def mac_payload_offset(frame):
+    """return the offset of the MAC payload within a frame"""
+    return frame_control(frame).payload_offset
 
 class IEEE802154Framer(object):
     frame_type_name = {0: "Beacon",
@@ -15,13 +102,23 @@ class IEEE802154Framer(object):
 
     def parseheader(self):
         if len(self.frame) >= 2:
-            framecontrol, = struct.unpack("<H", self.frame[:2])
+            framecontrol, = frame_control_format.unpack_from(self.frame)
             return framecontrol
         return None
 
+    @property
+    def control(self):
+        """decoded frame control, raises a FrameError for reserved values"""
+        if self.fc is None:
+            raise FrameError("frame is too short (%d bytes)" % len(self.frame))
+        return frame_controls[self.fc]
+
     def frame_type(self):
         ftype = self.fc & 0x00007
-        return self.frame_type_name[ftype]
+        try:
+            return self.frame_type_name[ftype]
+        except KeyError:
+            raise FrameError("frame type %d is reserved" % ftype)
     def sec_enabled(self):
         return (self.fc & 0x0008) == 0x0008
     def is_frame_pending(self):
@@ -37,71 +134,91 @@ class IEEE802154Framer(object):
     def src_addr_mode(self):
         return (self.fc & 0xc000) >> 14
     def src_addr_size(self):
-        mode = self.src_addr_mode()
-        if mode == 0:
-            return 0
-        elif mode == 2:
-            return 2
-        elif mode == 3:
-            return 8
-        else:
-            raise Exception()
+        return self.control.src_addr_size
     def dst_addr_size(self):
-        mode = self.dst_addr_mode()
-        if mode == 0:
-            return 0
-        elif mode == 2:
-            return 2
-        elif mode == 3:
-            return 8
-        else: # reserved
-            raise Exception()
+        return self.control.dst_addr_size
 
     def is_dst_panid_present(self):
-        if self.src_addr_size() and self.dst_addr_size():
-            if self.is_pan_id_compressed():
-                return True
-            else:
-                return True
-        elif self.src_addr_size():
-            if self.is_pan_id_compressed():
-                raise Exception()
-            else:
-                return False
-        elif self.dst_addr_size():
-            if self.is_pan_id_compressed():
-                raise Exception()
-            else:
-                return True
-        elif self.dst_addr_size() == 0 and self.src_addr_size() == 0:
-            return False
-        else:
-            raise Exception()
+        return self.control.dst_panid_present
 
     def is_src_panid_present(self):
-        if self.src_addr_size() and self.dst_addr_size():
-            if self.is_pan_id_compressed():
-                return False
-            else:
-                return True
-        elif self.src_addr_size():
-            if self.is_pan_id_compressed():
-                raise Exception()
-            else:
-                return True
-        elif self.dst_addr_size():
-            if self.is_pan_id_compressed():
-                raise Exception()
-            else:
-                return False
-        elif self.dst_addr_size() == 0 and self.src_addr_size() == 0:
-            return False
-        else:
-            raise Exception()
+        return self.control.src_panid_present
+
     def compute_mac_payload_offset(self):
-        offset = 3
-        offset += 2 if self.is_src_panid_present() else 0
-        offset += 2 if self.is_dst_panid_present() else 0
-        offset += self.src_addr_size()
-        offset += self.dst_addr_size()
-        return offset
+        return self.control.payload_offset
+
+class Frame(object):
+    """read-only view of an IEEE 802.15.4 frame
+
+    the frame is not copied and its fields are only decoded when they are
+    accessed, addresses are integers (or None when they are not present)"""
+    __slots__ = ('buffer', '_control')
+    def __init__(self, buffer):
+        self.buffer = buffer if type(buffer) is memoryview else memoryview(buffer)
+        self._control = None
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def control(self):
+        """decoded frame control, raises a FrameError for reserved values"""
+        if self._control is None:
+            self._control = frame_control(self.buffer)
+        return self._control
+
+    @property
+    def frame_type(self):
+        return self.control.frame_type
+
+    @property
+    def sequence_number(self):
+        return byte_format.unpack_from(self.buffer, 2)[0]
+
+    def field(self, offset, size):
+        return field_formats[size].unpack_from(self.buffer, offset)[0]
+
+    @property
+    def dst_pan_id(self):
+        if not self.control.dst_panid_present:
+            return None
+        return self.field(3, 2)
+
+    @property
+    def dst_address(self):
+        control = self.control
+        if not control.dst_addr_size:
+            return None
+        return self.field(control.dst_addr_offset, control.dst_addr_size)
+
+    @property
+    def src_pan_id(self):
+        control = self.control
+        if control.src_panid_present:
+            return self.field(control.src_panid_offset, 2)
+        if control.src_addr_size and control.pan_id_compressed:
+            return self.dst_pan_id
+        return None
+
+    @property
+    def src_address(self):
+        control = self.control
+        if not control.src_addr_size:
+            return None
+        return self.field(control.src_addr_offset, control.src_addr_size)
+
+    @property
+    def payload(self):
+        """MAC payload (a memoryview on the frame)"""
+        return self.buffer[self.control.payload_offset:]
+
+    @property
+    def payload_type(self):
+        """first byte of the MAC payload (None if the payload is empty)"""
+        offset = self.control.payload_offset
+        if offset >= len(self.buffer):
+            return None
+        return byte_format.unpack_from(self.buffer, offset)[0]
+
+    def tobytes(self):
+        return self.buffer.tobytes()
@@ -0,0 +1,225 @@
+"""synthetic simulation messages, for testing the logger and the viewer
+without running a simulation"""
+import random, struct, time
+from parser import OUTBOUND_FRAME, LOG_HEADER, SIM_END, \
+                   TYPE_ONENODE, TYPE_TWONODES, TYPE_MANYNODES
+
+AKM_PAYLOAD = 0x47
+
+onenode_header = struct.Struct("!BBBH")
+twonodes_header = struct.Struct("!BBBHH")
+manynodes_header = struct.Struct("!BBBH")
+# IEEE 802.15.4 data frame, PAN ID compression, short addresses:
+# frame control, sequence number, destination PAN ID, destination and source
+# addresses (little endian)
+mac_header = struct.Struct("<HBHHH")
+sim_timestamp = struct.Struct("!Q")
+MAC_DATA_FRAME = 0x0001 | 0x0040 | (2 << 10) | (2 << 14)
+PAN_ID = 0xabcd
+BROADCAST = 0xffff
+
+def node_list(nodes):
+    return struct.pack("!%dH" % len(nodes), *nodes)
+
+def onenode_message(subtype, node, data=""):
+    return onenode_header.pack(LOG_HEADER, TYPE_ONENODE, subtype, node) + data
+
+def twonodes_message(subtype, node_a, node_b, data=""):
+    return twonodes_header.pack(LOG_HEADER, TYPE_TWONODES, subtype, node_a, node_b) + data
+
+def manynodes_message(subtype, nodes, data=""):
+    return manynodes_header.pack(LOG_HEADER, TYPE_MANYNODES, subtype, len(nodes)) + \
+            node_list(nodes) + data
+
+def mac_frame(source, payload, sequence=0, destination=BROADCAST):
+    return mac_header.pack(MAC_DATA_FRAME, sequence & 0xff, PAN_ID,
+                           destination, source) + payload
+
+def packet_message(node, good_nodes, bad_nodes, timestamp, frame):
+    """OUTBOUND_FRAME message, timestamp is in microseconds"""
+    return chr(OUTBOUND_FRAME) + struct.pack("!HH", node, len(good_nodes)) + \
+            node_list(good_nodes) + struct.pack("!H", len(bad_nodes)) + \
+            node_list(bad_nodes) + sim_timestamp.pack(timestamp) + frame
+
+def timestamp_offset(message):
+    """return the offset of the timestamp of an OUTBOUND_FRAME message (None
+    for other messages)"""
+    if ord(message[0]) != OUTBOUND_FRAME:
+        return None
+    num_good, = struct.unpack_from("!H", message, 3)
+    num_bad, = struct.unpack_from("!H", message, 5 + 2 * num_good)
+    return 7 + 2 * (num_good + num_bad)
+
+def end_message():
+    return chr(SIM_END)
+
+AKM_LINK_STATES = ["AUTHENTICATED", "PENDING_SEND_CHALLENGE",
+                   "CHALLENGE_SENT_WAITING_FOR_OK", "OK_SENT_WAITING_FOR_ACK",
+                   "UNAUTHENTICATED"]
+AKM_NODE_STATES = ["AUTHENTICATED_SATURATED", "AUTHENTICATED_UNSATURATED",
+                   "UNAUTHENTICATED"]
+
+# kinds of messages the generator knows about
+KINDS = ["join", "exit", "link", "node", "rpl", "frame"]
+
+def parse_mix(mix):
+    """parse a message mix, e.g. "join=1,link=4,frame=10", into a list of
+    (kind, weight)"""
+    weights = []
+    for item in mix.split(","):
+        kind, weight = item.split("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError("unknown message kind %s (expected one of %s)" %
+                             (kind, ", ".join(KINDS)))
+        weights.append((kind, float(weight)))
+    return weights
+
+class MessageGenerator(object):
+    """generate random, well-formed simulation messages for nodes 1 to
+    n_nodes, with the proportions of the message mix
+
+    data frames are timestamped with the current time, or with time_base (in
+    seconds) when it is set, so that the messages only depend on the seed"""
+    def __init__(self, n_nodes, mix, neighbors=8, seed=None, time_base=None):
+        if n_nodes < 2:
+            raise ValueError("at least two nodes are needed")
+        self.n_nodes = n_nodes
+        self.neighbors = min(neighbors, n_nodes - 1)
+        self.random = random.Random(seed)
+        builders = {"join": self.join, "exit": self.exit, "link": self.akm_link,
+                    "node": self.akm_node, "rpl": self.rpl, "frame": self.frame}
+        self.builders = []
+        self.thresholds = []
+        total = 0.
+        for kind, weight in mix:
+            total += weight
+            self.builders.append(builders[kind])
+            self.thresholds.append(total)
+        self.total = total
+        self.sequence = 0
+        self.time_base = time_base
+
+    def random_node(self):
+        return self.random.randint(1, self.n_nodes)
+
+    def other_nodes(self, node, count):
+        others = self.random.sample(xrange(1, self.n_nodes), count)
+        # node is not part of the sample
+        return [other if other < node else other + 1 for other in others]
+
+    def message(self):
+        draw = self.random.random() * self.total
+        for builder, threshold in zip(self.builders, self.thresholds):
+            if draw < threshold:
+                break
+        return builder()
+
+    def join(self):
+        return onenode_message(1, self.random_node())
+
+    def exit(self):
+        return onenode_message(2, self.random_node())
+
+    def akm_link(self):
+        node = self.random_node()
+        return twonodes_message(4, node, self.other_nodes(node, 1)[0],
+                                self.random.choice(AKM_LINK_STATES))
+
+    def akm_node(self):
+        return onenode_message(6, self.random_node(), self.random.choice(AKM_NODE_STATES))
+
+    def rpl(self):
+        node = self.random_node()
+        parents = self.other_nodes(node, self.random.randint(1, 3))
+        return manynodes_message(5, [node] + parents, "RPL")
+
+    def frame(self):
+        node = self.random_node()
+        neighbors = self.other_nodes(node, self.random.randint(0, self.neighbors))
+        n_good = self.random.randint(0, len(neighbors))
+        self.sequence += 1
+        payload_type = AKM_PAYLOAD if self.random.random() < 0.5 else 0x41
+        frame = mac_frame(node, chr(payload_type) + "\0" * 16, self.sequence)
+        sent = self.time_base if self.time_base is not None else time.time()
+        return packet_message(node, neighbors[:n_good], neighbors[n_good:],
+                              int(sent * 1e6), frame)
+
+    def pool(self, size):
+        """pregenerate size messages"""
+        return [self.message() for i in xrange(size)]
+
+class LoadGenerator(object):
+    """send messages to a multicast group at a target rate
+
+    messages are sent in bursts of burst_size messages, bursts being spaced
+    so that the average rate is rate messages per second (or as fast as
+    possible if rate is None)
+
+    data frames are timestamped when they are sent, so that the latency of
+    the logger can be measured (see logger.simtime)"""
+    def __init__(self, sock, destination, messages, rate=None, burst_size=1):
+        self.sock = sock
+        self.destination = destination
+        self.stamps = [timestamp_offset(message) for message in messages]
+        # data frames are copied so that their timestamp can be updated
+        self.messages = [bytearray(message) if offset is not None else message
+                         for message, offset in zip(messages, self.stamps)]
+        self.rate = rate
+        self.burst_size = burst_size
+        self.sent = 0
+        self.sent_bytes = 0
+        self.errors = 0 # e.g. ENOBUFS when the sender outpaces the interface
+        self.elapsed = 0.
+
+    def run(self, duration=None, count=None, report=None, report_interval=1.):
+        """send messages until duration seconds elapsed or count messages
+        were sent, report is called every report_interval seconds with the
+        number of messages sent and the elapsed time"""
+        sendto = self.sock.sendto
+        destination = self.destination
+        messages = self.messages
+        stamps = self.stamps
+        stamp = sim_timestamp.pack_into
+        n_messages = len(messages)
+        interval = float(self.burst_size) / self.rate if self.rate else 0.
+        start = time.time()
+        next_burst = start
+        next_report = start + report_interval
+        last_sent, last_report = 0, start
+        index = 0
+        while True:
+            now = time.time()
+            if (duration is not None and now - start >= duration) or \
+               (count is not None and self.sent >= count):
+                break
+            if report and now >= next_report:
+                report(self.sent - last_sent, now - last_report)
+                last_sent, last_report = self.sent, now
+                next_report = now + report_interval
+            if interval:
+                if now < next_burst:
+                    time.sleep(next_burst - now)
+                next_burst += interval
+            burst = self.burst_size
+            if count is not None:
+                burst = min(burst, count - self.sent)
+            for i in xrange(burst):
+                message = messages[index]
+                if stamps[index] is not None:
+                    stamp(message, stamps[index], int(time.time() * 1e6))
+                index = (index + 1) % n_messages
+                try:
+                    sendto(message, destination)
+                except IOError:
+                    self.errors += 1
+                    continue
+                self.sent += 1
+                self.sent_bytes += len(message)
+        self.elapsed = time.time() - start
+        return self.sent
+
+    def stats(self):
+        rate = self.sent / self.elapsed if self.elapsed else 0.
+        return "%d messages (%d bytes) sent in %.3f seconds (%.0f messages/s, %d send errors)" % \
+                (self.sent, self.sent_bytes, self.elapsed, rate, self.errors)
@@ -0,0 +1,226 @@
+"""time and node index of the text logs
+
+the index is stored in a sidecar file (the log file name followed by .idx)
+and starts with a file header (magic string and format version) followed
+by blocks, each block covering the lines logged during checkpoint_interval
+seconds:
+- block header: time of the first and last line of the block (doubles,
+  in seconds since the start of the log), offset of the first line of the
+  block and offset following its last line (8 bytes each), size of the
+  block body and number of nodes appearing in the block (4 bytes each)
+- block body: the directory of the block, that is for each node appearing
+  in the block the node identifier (2 bytes) and the number of lines
+  involving this node (4 bytes), followed by the postings of the nodes (in
+  the order of the directory): the offsets of the lines involving the node
+  relative to the beginning of the block (4 bytes each)
+
+all values are big endian. Blocks are appended as the log grows, so that an
+index can be queried while the simulation is still running. Loading an
+index only reads the block headers and directories, a node query then reads
+the postings of this node only.
+
+the times of the lines must not go backwards (blocks are searched by time),
+a line older than the previous one is indexed at the time of the previous
+one"""
+import struct, os
+from array import array
+from bisect import bisect_left, bisect_right
+
+INDEX_SUFFIX = ".idx"
+MAGIC = "W154IDX"
+VERSION = 1
+
+file_header = struct.Struct("!7sB")
+block_header = struct.Struct("!ddQQII")
+posting_header = struct.Struct("!HI")
+
+class LogIndexError(Exception):
+    pass
+
+def index_filename(log_filename):
+    return log_filename + INDEX_SUFFIX
+
+class LogIndexWriter(object):
+    """build the index of a log while it is being written"""
+    def __init__(self, filename, checkpoint_interval=1.0):
+        self.fd = open(filename, mode='wb')
+        self.fd.write(file_header.pack(MAGIC, VERSION))
+        self.checkpoint_interval = checkpoint_interval
+        self.block_start = None # time of the first line of the current block
+        self.block_end = None
+        self.block_offset = 0
+        self.block_end_offset = 0
+        self.postings = {}
+
+    def add(self, offset, size, elapsed, nodes):
+        """record a line of size bytes, written at offset, elapsed seconds
+        after the start of the log and involving the nodes"""
+        if self.block_end is not None and elapsed < self.block_end:
+            elapsed = self.block_end # the clock went backwards
+        if self.block_start is None:
+            self.block_start, self.block_offset = elapsed, offset
+        elif elapsed >= self.block_start + self.checkpoint_interval:
+            self.write_block()
+            self.block_start, self.block_offset = elapsed, offset
+        self.block_end = elapsed
+        self.block_end_offset = offset + size
+
+        relative_offset = offset - self.block_offset
+        postings = self.postings
+        for node in nodes:
+            try:
+                offsets = postings[node]
+            except KeyError:
+                offsets = postings[node] = array('I')
+            if not offsets or offsets[-1] != relative_offset: # node listed twice
+                offsets.append(relative_offset)
+
+    def write_block(self):
+        if self.block_start is None:
+            return
+        postings = sorted(self.postings.iteritems())
+        body = [posting_header.pack(node, len(offsets)) for node, offsets in postings]
+        body.extend([struct.pack("!%dI" % len(offsets), *offsets)
+                     for node, offsets in postings])
+        body = "".join(body)
+        self.fd.write(block_header.pack(self.block_start, self.block_end,
+                                        self.block_offset, self.block_end_offset,
+                                        len(body), len(postings)))
+        self.fd.write(body)
+        self.fd.flush()
+        self.block_start = None
+        self.postings = {}
+
+    def close(self):
+        if self.fd:
+            self.write_block()
+            self.fd.close()
+            self.fd = None
+
+class LogIndex(object):
+    """query a log through its index
+
+    the block headers and directories are loaded, the postings of a node
+    are read when a query needs them"""
+    def __init__(self, log_filename, index=None):
+        self.log_filename = log_filename
+        self.index_filename = index or index_filename(log_filename)
+        self.starts = []
+        self.ends = []
+        self.offsets = []
+        self.end_offsets = []
+        # node to the blocks it appears in, and the (position, count) of its
+        # postings in the index for each of these blocks
+        self.node_blocks = {}
+        self.node_postings = {}
+        self.load()
+
+    def load(self):
+        with open(self.index_filename, mode='rb') as fd:
+            size = os.fstat(fd.fileno()).st_size
+            header = fd.read(file_header.size)
+            if len(header) < file_header.size or file_header.unpack(header) != (MAGIC, VERSION):
+                raise LogIndexError("%s is not an index in a supported format (rebuild it)" %
+                                    self.index_filename)
+            position = file_header.size
+            while position + block_header.size <= size:
+                fd.seek(position)
+                start, end, offset, end_offset, body_size, n_nodes = \
+                        block_header.unpack(fd.read(block_header.size))
+                position += block_header.size
+                if position + body_size > size: # block is being written
+                    break
+                block = len(self.starts)
+                self.starts.append(start)
+                self.ends.append(end)
+                self.offsets.append(offset)
+                self.end_offsets.append(end_offset)
+                directory = fd.read(posting_header.size * n_nodes)
+                postings = position + len(directory)
+                for entry in xrange(n_nodes):
+                    node, count = posting_header.unpack_from(directory, entry * posting_header.size)
+                    try:
+                        blocks = self.node_blocks[node]
+                    except KeyError:
+                        blocks = self.node_blocks[node] = array('I')
+                        self.node_postings[node] = []
+                    blocks.append(block)
+                    self.node_postings[node].append((postings, count))
+                    postings += 4 * count
+                position += body_size
+
+    def blocks(self, start=None, end=None):
+        """return the indexes of the blocks that may contain lines logged
+        between start and end (in seconds since the start of the log), the
+        blocks being sorted by time"""
+        first = 0
+        if start is not None:
+            first = max(0, bisect_right(self.starts, start) - 1)
+            # the block starting before start may end before it too
+            if first < len(self.ends) and self.ends[first] < start:
+                first += 1
+        last = len(self.starts)
+        if end is not None:
+            last = bisect_right(self.starts, end)
+        return xrange(first, last)
+
+    def node_offsets(self, node, start=None, end=None):
+        """return the offsets of the lines involving a node, between start
+        and end (only filtered at the block level)"""
+        offsets = []
+        if node not in self.node_blocks:
+            return offsets
+        node_blocks = self.node_blocks[node]
+        postings = self.node_postings[node]
+        blocks = self.blocks(start, end)
+        first = bisect_left(node_blocks, blocks[0]) if blocks else 0
+        last = bisect_left(node_blocks, blocks[-1] + 1) if blocks else 0
+        with open(self.index_filename, mode='rb') as fd:
+            for block, (position, count) in zip(node_blocks[first:last], postings[first:last]):
+                fd.seek(position)
+                block_offset = self.offsets[block]
+                offsets.extend([block_offset + offset for offset in
+                                struct.unpack("!%dI" % count, fd.read(4 * count))])
+        return offsets
+
+    def query(self, node=None, start=None, end=None):
+        """return the lines logged between start and end (in seconds since
+        the start of the log) that involve node (all the nodes if unset)"""
+        lines = []
+        with open(self.log_filename) as fd:
+            if node is not None:
+                for offset in self.node_offsets(node, start, end):
+                    fd.seek(offset)
+                    lines.append(fd.readline())
+            else:
+                blocks = self.blocks(start, end)
+                if not blocks:
+                    return lines
+                fd.seek(self.offsets[blocks[0]])
+                remaining = self.end_offsets[blocks[-1]] - self.offsets[blocks[0]]
+                for line in fd.read(remaining).splitlines(True):
+                    lines.append(line)
+        return [line for line in lines if line.endswith("\n") and
+                in_window(line_time(line), start, end)]
+
+def line_time(line):
+    """return the time of a log line"""
+    return float(line.split(None, 1)[0])
+
+def line_nodes(line):
+    """return the nodes involved in a log line"""
+    nodes = line[line.index("[") + 1:line.index("]")]
+    return [int(node) for node in nodes.split(",") if node.strip()]
+
+def in_window(elapsed, start, end):
+    return (start is None or elapsed >= start) and (end is None or elapsed <= end)
+
+def build_index(log_filename, checkpoint_interval=1.0):
+    """index an existing log"""
+    index = LogIndexWriter(index_filename(log_filename), checkpoint_interval)
+    offset = 0
+    with open(log_filename) as fd:
+        for line in fd:
+            index.add(offset, len(line), line_time(line), line_nodes(line))
+            offset += len(line)
+    index.close()
@@ -0,0 +1,121 @@
+"""self-instrumentation of the logger, exposed in the Prometheus text format
+
+counters are plain attributes of the objects they count (e.g.
+BatchReceiver.packets or DispatchTable.failures) and are updated by the
+receiving thread without locks. A MetricsRegistry only reads them when the
+metrics are collected, so that the hot path does not pay for the registry.
+
+the metrics can be served over HTTP (HOST:PORT) or over HTTP on a Unix socket
+(a path), e.g. curl --unix-socket /tmp/logger.sock http://localhost/metrics"""
+import os, SocketServer
+from threading import Thread
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from tools import PRINT
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+class MetricsRegistry(object):
+    """metrics to collect, each metric is read by a function called when the
+    metrics are collected
+
+    the function of a counter or a gauge returns a number (or None if it is
+    unknown), or a dictionary of numbers indexed by the value of the label of
+    the metric. Histograms are LatencyHistogram objects."""
+    def __init__(self, prefix="wiredto154_logger_"):
+        self.prefix = prefix
+        self.metrics = [] # (name, type, help, function or histogram, label)
+
+    def counter(self, name, help, collect, label=None):
+        self.metrics.append((name, "counter", help, collect, label))
+
+    def gauge(self, name, help, collect, label=None):
+        self.metrics.append((name, "gauge", help, collect, label))
+
+    def histogram(self, name, help, histogram):
+        self.metrics.append((name, "histogram", help, histogram, None))
+
+    def samples(self, collect, label):
+        """return the (labels, value) samples of a counter or a gauge"""
+        value = collect()
+        if label is None:
+            return [("", value)] if value is not None else []
+        return [('{%s="%s"}' % (label, key), value)
+                for key, value in sorted(value.iteritems())]
+
+    def exposition(self):
+        """return the metrics in the Prometheus text format"""
+        lines = []
+        for name, metric_type, help, collect, label in self.metrics:
+            name = self.prefix + name
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            if metric_type != "histogram":
+                lines.extend(["%s%s %s" % (name, labels, value)
+                              for labels, value in self.samples(collect, label)])
+                continue
+            histogram = collect
+            cumulative = 0
+            for bucket, count in enumerate(histogram.counts[:-1]):
+                cumulative += count
+                lines.append('%s_bucket{le="%g"} %d' % (name, (1 << bucket) * 1e-6, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %d' % (name, histogram.count))
+            lines.append("%s_sum %r" % (name, histogram.total))
+            lines.append("%s_count %d" % (name, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """return a one-line summary of the metrics, labelled values are
+        added up and histograms are summarized by their 99th percentile"""
+        items = []
+        for name, metric_type, help, collect, label in self.metrics:
+            if metric_type == "histogram":
+                items.append("%s_p99=%.3fms" % (name, collect.percentile(99) * 1e3))
+                continue
+            values = [value for labels, value in self.samples(collect, label)]
+            if label is None and not values: # unknown value
+                continue
+            items.append("%s=%d" % (name, sum(values)))
+        return " ".join(items)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        PRINT("metrics request from %s: %s" % (self.address_string(), format % args))
+
+class MetricsServer(object):
+    """serve the metrics of a registry from a background thread, address is
+    either HOST:PORT (HTTP) or the path of a Unix socket"""
+    def __init__(self, registry, address):
+        self.path = None
+        if address.startswith("/") or ":" not in address:
+            self.path = address
+            if os.path.exists(address): # left over by a previous run
+                os.unlink(address)
+            self.server = SocketServer.UnixStreamServer(address, MetricsHandler)
+        else:
+            host, port = address.rsplit(":", 1)
+            self.server = HTTPServer((host, int(port)), MetricsHandler)
+        self.server.registry = registry
+        self.thread = Thread(target=self.server.serve_forever, name="metrics server")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.path:
+            os.unlink(self.path)
@@ -3,12 +3,27 @@
 from socket import inet_pton, AF_INET, AF_INET6, \
         SOCK_DGRAM, IPPROTO_IP, IPPROTO_UDP, IPPROTO_IPV6, \
         IPV6_JOIN_GROUP, SOL_SOCKET, \
-        SO_REUSEADDR, INADDR_ANY, IP_ADD_MEMBERSHIP
-import socket, struct
+        SO_REUSEADDR, SO_RCVBUF, INADDR_ANY, IP_ADD_MEMBERSHIP, MSG_DONTWAIT, \
+        IP_MULTICAST_TTL, IP_MULTICAST_LOOP, IPV6_MULTICAST_HOPS, IPV6_MULTICAST_LOOP
+from errno import EAGAIN, EWOULDBLOCK, ENOENT
+from tools import PRINT
+import fcntl, socket, struct, os, time
 
-def multicast_listener(address, port):
+# not exported by the socket module (value of the Linux kernel)
+SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33)
+# ioctl returning the kernel timestamp of the last datagram read (struct timespec)
+SIOCGSTAMPNS = 0x8907
+timespec = struct.Struct("@ll")
+
+def multicast_listener(address, port, rcvbuf=None, bind_group=False):
     """start a multicast listener on the specified address and port
-    or throw an exception trying"""
+    or throw an exception trying
+
+    rcvbuf is the requested size (in bytes) of the kernel receive buffer
+
+    when bind_group is set, the socket is bound to the group address and only
+    receives the datagrams of this group (rather than those of all the groups
+    joined on the host with the same port)"""
 
     sock = None
 
@@ -25,17 +40,181 @@ def multicast_listener(address, port):
     if address_type == "IPv4":
         sock = socket.socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP)
         sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        sock.bind(('', port))
+        sock.bind((address if bind_group else '', port))
         mreq = struct.pack("4sl", inet_pton(AF_INET, address), INADDR_ANY)
         sock.setsockopt(IPPROTO_IP, IP_ADD_MEMBERSHIP, mreq)
     else: # IPv6
         sock = socket.socket(AF_INET6, SOCK_DGRAM, IPPROTO_UDP)
         sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        sock.bind(('',port))
+        sock.bind((address if bind_group else '', port))
         mreq = inet_pton(AF_INET6, address)
         ifn = struct.pack("I", 0) # system choses the interface
         # if we wanted to constrain to a specific interface
         # sock.setsockopt(IPPROTO_IPV6, IPV6_MULTICAST_IF, ifn)
         sock.setsockopt(IPPROTO_IPV6, IPV6_JOIN_GROUP, mreq + ifn)
 
+    if rcvbuf:
+        set_receive_buffer(sock, rcvbuf)
+
     return sock
+
+def multicast_sender(address, port, ttl=1):
+    """create a socket sending to the specified multicast group and return
+    it along with the destination to pass to sendto(), or throw an exception
+    trying
+
+    datagrams are looped back to the local host, so that a listener running
+    on the same machine receives them"""
+    try:
+        inet_pton(AF_INET, address)
+        address_type = "IPv4"
+    except socket.error:
+        inet_pton(AF_INET6, address) # raises an exception on invalid addresses
+        address_type = "IPv6"
+
+    if address_type == "IPv4":
+        sock = socket.socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP)
+        sock.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, ttl)
+        sock.setsockopt(IPPROTO_IP, IP_MULTICAST_LOOP, 1)
+        return sock, (address, port)
+    else: # IPv6
+        sock = socket.socket(AF_INET6, SOCK_DGRAM, IPPROTO_UDP)
+        sock.setsockopt(IPPROTO_IPV6, IPV6_MULTICAST_HOPS, ttl)
+        sock.setsockopt(IPPROTO_IPV6, IPV6_MULTICAST_LOOP, 1)
+        return sock, (address, port, 0, 0)
+
+def set_receive_buffer(sock, size):
+    """set the size of the kernel receive buffer of a socket, bypassing the
+    system wide limit (net.core.rmem_max) when the process is allowed to, and
+    return the effective size"""
+    sock.setsockopt(SOL_SOCKET, SO_RCVBUF, size)
+    # Linux doubles the value to account for its bookkeeping overhead
+    if sock.getsockopt(SOL_SOCKET, SO_RCVBUF) < size:
+        try:
+            sock.setsockopt(SOL_SOCKET, SO_RCVBUFFORCE, size)
+        except socket.error: # requires CAP_NET_ADMIN
+            PRINT("receive buffer size is capped by net.core.rmem_max")
+    effective_size = sock.getsockopt(SOL_SOCKET, SO_RCVBUF)
+    PRINT("receive buffer size is %d bytes" % effective_size)
+    return effective_size
+
+def udp_socket_entry(sock):
+    """return the fields of the line describing a socket in /proc/net/udp
+    (or udp6), or None if it can not be found"""
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    for table in ("/proc/net/udp", "/proc/net/udp6"):
+        try:
+            with open(table) as fd:
+                fd.readline() # header
+                for line in fd:
+                    fields = line.split()
+                    # the inode is the 10th field
+                    if fields[9] == inode:
+                        return fields
+        except IOError: # not running on Linux
+            return None
+    return None
+
+def kernel_drops(sock):
+    """return the number of datagrams the kernel dropped for this socket
+    (because its receive buffer was full) or None if it can not be found"""
+    fields = udp_socket_entry(sock)
+    # the drops are the last field
+    return int(fields[-1]) if fields else None
+
+def receive_queue(sock):
+    """return the number of bytes waiting in the receive buffer of a socket
+    or None if it can not be found"""
+    fields = udp_socket_entry(sock)
+    # 5th field is tx_queue:rx_queue (hexadecimal)
+    return int(fields[4].split(":")[1], 16) if fields else None
+
+def enable_timestamps(sock):
+    """ask the kernel to timestamp the datagrams of a socket as they are
+    received, return False if the system does not support it
+
+    Python 2 sockets do not provide recvmsg(), so the timestamps can not be
+    read from the ancillary data of the datagrams (SO_TIMESTAMPNS). They are
+    read with the SIOCGSTAMPNS ioctl instead, whose first call turns the
+    timestamping on (and fails as no datagram was timestamped yet)"""
+    try:
+        fcntl.ioctl(sock.fileno(), SIOCGSTAMPNS, "\0" * timespec.size)
+    except IOError, e:
+        if e.errno != ENOENT:
+            PRINT("kernel timestamps are not supported, datagrams are timestamped when read")
+            return False
+    return True
+
+def receive_timestamp(sock):
+    """return the time (in seconds since the epoch) the last datagram read
+    from sock was received by the kernel, or None if it was not timestamped"""
+    try:
+        seconds, nanoseconds = timespec.unpack(
+                fcntl.ioctl(sock.fileno(), SIOCGSTAMPNS, "\0" * timespec.size))
+    except IOError:
+        return None
+    return seconds + nanoseconds * 1e-9
+
+class BatchReceiver(object):
+    """drain several datagrams per wake-up into a pool of preallocated buffers
+
+    receive() returns memoryview slices of the pool buffers, they are only
+    valid until the next call to receive()
+
+    the time each datagram was received is stored in the timestamps list
+    (one entry per datagram returned by receive()). When kernel_timestamps is
+    set, this is the time the kernel received the datagram, otherwise the time
+    it was read from the socket"""
+    def __init__(self, sock, batch_size=64, buffer_size=65535, kernel_timestamps=False):
+        self.sock = sock
+        self.kernel_timestamps = kernel_timestamps and enable_timestamps(sock)
+        self.timestamps = []
+        self.buffers = [bytearray(buffer_size) for i in xrange(batch_size)]
+        self.views = [memoryview(buf) for buf in self.buffers]
+        self.spare_views = self.views[1:]
+        # statistics: number of batches, number of datagrams (and bytes) and
+        # how many batches returned exactly n datagrams
+        self.batches = 0
+        self.packets = 0
+        self.bytes = 0
+        self.batch_sizes = [0] * (batch_size + 1)
+
+    def receive(self):
+        """wait for a datagram (unless the socket is non-blocking) and return
+        it along with all the datagrams already queued on the socket, up to
+        batch_size datagrams"""
+        sock = self.sock
+        views = self.views
+        if self.kernel_timestamps:
+            stamp = lambda: receive_timestamp(sock) or time.time()
+        else:
+            stamp = time.time
+        # the first read follows the socket blocking mode, errors are
+        # forwarded to the caller
+        nbytes, addr = sock.recvfrom_into(views[0])
+        datagrams = [views[0][:nbytes]]
+        timestamps = self.timestamps = [stamp()]
+        total = nbytes
+        for view in self.spare_views:
+            try:
+                nbytes, addr = sock.recvfrom_into(view, 0, MSG_DONTWAIT)
+            except socket.error, e:
+                if e.errno in (EAGAIN, EWOULDBLOCK): # socket queue is empty
+                    break
+                raise
+            datagrams.append(view[:nbytes])
+            timestamps.append(stamp())
+            total += nbytes
+
+        self.batches += 1
+        self.packets += len(datagrams)
+        self.bytes += total
+        self.batch_sizes[len(datagrams)] += 1
+        return datagrams
+
+    def stats(self):
+        """return a one-line summary of the batch statistics"""
+        histogram = ", ".join(["%d: %d" % (size, count) for size, count \
+                               in enumerate(self.batch_sizes) if count])
+        return "%d datagrams received in %d batches (batch size: count) {%s}" % \
+                (self.packets, self.batches, histogram)
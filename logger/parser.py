@@ -1,7 +1,10 @@
 """simulation log message parser"""
 import struct, time
-from threading import Timer
+from threading import Timer, Thread, Event, Lock
 from tools import PRINT, simulation_end
+from framer import Frame
+from simtime import LatencyHistogram
+import tools
 
 # protocol constants
 
@@ -12,10 +15,54 @@ TYPE_ONENODE = 1
 TYPE_TWONODES = 2
 TYPE_MANYNODES = 3
 
+# precompiled message headers (the entry type has already been read)
+onenode_header = struct.Struct("!BH")
+twonodes_header = struct.Struct("!BHH")
+manynodes_header = struct.Struct("!BH")
+packet_header = struct.Struct("!HH")
+node_count = struct.Struct("!H")
+sim_timestamp = struct.Struct("!Q")
+
+# duration of a unit of the simulation timestamp of the data frames (in seconds)
+SIM_TIMESTAMP_UNIT = 1e-6
+
+class StructTable(dict):
+    """precompiled formats of a variable length field, indexed by the number
+    of items of the field and filled as new lengths are seen"""
+    def __init__(self, format):
+        dict.__init__(self)
+        self.format = format
+
+    def __missing__(self, n_items):
+        value = self[n_items] = struct.Struct(self.format % n_items)
+        return value
+
+# node lists formats, indexed by their number of nodes
+node_list_formats = StructTable("!%dH")
+# formats of the good nodes of a data frame followed by the number of bad
+# nodes, and of the bad nodes followed by the timestamp
+good_nodes_formats = StructTable("!%dHH")
+bad_nodes_formats = StructTable("!%dHQ")
+
+# label of the unknown sub-types, followed by the sub-type
+UNKNOWN_LABEL = "unknown-"
+
 class mydefaultdict(dict):
+    """labels of the sub-types of an entry type, unknown sub-types are
+    labelled unknown-N and counted (each lookup is counted, the labels are
+    kept apart so that the table only holds the known sub-types)"""
+    def __init__(self):
+        dict.__init__(self)
+        self.unknown_labels = {}
+        self.unknown = 0
+
     def __missing__(self, key):
-        value = self[key] = "unknown-%d" % key
-        return value
+        self.unknown += 1
+        try:
+            return self.unknown_labels[key]
+        except KeyError:
+            value = self.unknown_labels[key] = UNKNOWN_LABEL + str(key)
+            return value
 
 # define additional types here
 onenode_subtypes_l = [(1, "node join"), (2, "node exit"), (3, "node out of sync"),
@@ -38,10 +85,24 @@ subtypes = { TYPE_ONENODE: onenode_subtypes,
             TYPE_MANYNODES: manynode_subtypes}
 
 class TextLogger(object):
+    """write log entries as text lines
+
+    when flush_interval is set, lines are buffered in memory and written by a
+    background thread, either every flush_interval seconds or as soon as
+    flush_size bytes are pending (whichever comes first)
+
+    index is an optional LogIndexWriter that records where each line is
+    written (only meaningful when writing to a new file)
+
+    entries are timestamped with the time they were received (their 'time'
+    field, set by the dispatch table) rather than the time they are written,
+    so that buffering and batching do not skew the elapsed times"""
     fd = None
     subtype_max_len = 0
-    def __init__(self, filename):
+    def __init__(self, filename, flush_interval=None, flush_size=65536, index=None):
         self.start_time = None
+        self.index = index
+        self.offset = 0 # offset of the next line in the file
         if isinstance(filename, str):
             self.fd = open(filename, mode='w')
         else: # if we pass a file descriptor directly
@@ -50,114 +111,214 @@ class TextLogger(object):
                          for subtype in m_type.values()]
         self.subtype_max_len = max(map(len, subtype_names))
 
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.pending = []
+        self.pending_size = 0
+        self.lock = Lock() # protects the pending lines
+        self.fd_lock = Lock() # keeps the lines in order when writing
+        self.wakeup = Event()
+        self.running = False
+        self.closed = False # lines are written directly once close() has flushed
+        self.flusher = None
+        if flush_interval:
+            self.running = True
+            self.flusher = Thread(target=self.flush_loop, name="TextLogger flusher")
+            self.flusher.daemon = True
+            self.flusher.start()
+
     @staticmethod
     def compact_subtypename(type_name):
         return "".join(type_name.upper().split())
 
-    def write(self, log):
+    def elapsed(self, timestamp=None):
+        """return the time elapsed since the first entry, timestamp is the
+        time the entry was received (now if unset)"""
+        if timestamp is None:
+            timestamp = time.time()
         if not self.start_time:
-            self.start_time = time.time()
+            self.start_time = timestamp
+        return timestamp - self.start_time
+
+    def format(self, log, elapsed):
         subtype_name = TextLogger.compact_subtypename(subtypes[log['type']][log['subtype']])
 
-        msg = "{0:<18.6f} {1} [{2}] ({3})\n".format(
-            time.time() - self.start_time,
+        return "{0:<18.6f} {1} [{2}] ({3})\n".format(
+            elapsed,
             subtype_name + " " * (1 + self.subtype_max_len - len(subtype_name)),
             ", ".join([str(node) for node in log['nodes']]),
             log['data'])
-        self.fd.write(msg)
-        self.fd.flush()
-
-def dispatcher(data, logger):
-    # parse the message
-    if len(data) == 1 and ord(data[0]) == SIM_END:
-        print "received simulation end message, shutting down simulation in five seconds"
-        Timer(5.0, simulation_end).start()
-        return
-
-    if len(data) <= 4 or ord(data[0]) != LOG_HEADER :
-        return
-
-    # log the event accordingly
-    m_type = ord(data[1])
-    try:
-        if m_type == TYPE_ONENODE:
-            log_entry = parse_onenode(data[2:])
-        elif m_type == TYPE_TWONODES:
-            log_entry = parse_twonodes(data[2:])
-        elif m_type == TYPE_MANYNODES:
-            log_entry = parse_manynodes(data[2:])
-        else:
-            PRINT("message type %d is not recognized")
+
+    def measure(self):
+        """record how long each write takes (write_duration) and how long after
+        their reception the entries are written (write_delay), write() must
+        then be looked up after this call (e.g. when subscribing)"""
+        self.write_duration = LatencyHistogram()
+        self.write_delay = LatencyHistogram()
+        self.write = self.measured_write
+
+    def measured_write(self, log, timestamp=None):
+        start = time.time()
+        TextLogger.write(self, log, timestamp)
+        end = time.time()
+        self.write_duration.add(end - start)
+        received = timestamp if timestamp is not None else log.get('time')
+        if received is not None:
+            self.write_delay.add(end - received)
+
+    def write(self, log, timestamp=None):
+        if timestamp is None:
+            timestamp = log.get('time')
+        elapsed = self.elapsed(timestamp)
+        if self.index:
+            # index the time as it is printed, so that a query of the lines
+            # printed from a time on finds the line
+            elapsed = float("%.6f" % elapsed)
+        msg = self.format(log, elapsed)
+        if self.index:
+            self.index.add(self.offset, len(msg), elapsed, log['nodes'])
+            self.offset += len(msg)
+        if not self.flush_interval:
+            self.fd.write(msg)
+            self.fd.flush()
             return
-        log_entry['type'] = m_type
-    except struct.error:
-        PRINT("could not parse message of type %d" % m_type)
-        return
-
-    logger.write(log_entry)
-    try:
-        pass
-    except:
-        PRINT("could not write to the logger")
-
-def parse_packet(data):
+
+        with self.lock:
+            closed = self.closed
+            if not closed:
+                self.pending.append(msg)
+                self.pending_size += len(msg)
+                full = self.pending_size >= self.flush_size
+        if closed: # after the pending lines, that close() may still be writing
+            with self.fd_lock:
+                self.fd.write(msg)
+                self.fd.flush()
+        elif full:
+            self.wakeup.set()
+
+    def flush(self, close=False):
+        """write all the pending lines, and the next lines directly if close
+        is set"""
+        with self.fd_lock:
+            with self.lock:
+                lines = self.pending
+                self.pending = []
+                self.pending_size = 0
+                if close:
+                    self.closed = True
+            if lines:
+                self.fd.write("".join(lines))
+            self.fd.flush()
+
+    def flush_loop(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """stop the background writer and write all the pending lines"""
+        # close() can be called from several threads (e.g. at the end of the
+        # simulation and on exit), only one of them joins the flusher
+        flusher, self.flusher = self.flusher, None
+        if flusher:
+            self.running = False
+            self.wakeup.set()
+            flusher.join()
+        self.flush(True)
+        if self.index:
+            self.index.close()
+
+def end_of_simulation(entry):
+    """handler for the simulation end message"""
+    print "received simulation end message, shutting down simulation in five seconds"
+    Timer(5.0, simulation_end).start()
+
+class Packet(object):
+    """data frame sent by a node, and the nodes that received it (good nodes)
+    or not (bad nodes)
+
+    timestamp is the time the simulation sent the frame (in units of
+    SIM_TIMESTAMP_UNIT), time is the time the logger received it (in seconds
+    since the epoch, set by the dispatch table)
+
+    frame is a Frame view on the message (starting at frame_offset), built
+    when it is first accessed, it is only valid as long as the message buffer
+    is"""
+    __slots__ = ('node', 'good_nodes', 'bad_nodes', 'timestamp', 'message',
+                 'frame_offset', '_frame', 'time')
+    def __init__(self, node, good_nodes, bad_nodes, timestamp, message, frame_offset=0, time=None):
+        self.node = node
+        self.good_nodes = good_nodes
+        self.bad_nodes = bad_nodes
+        self.timestamp = timestamp
+        self.message = message
+        self.frame_offset = frame_offset
+        self._frame = None
+        self.time = time
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            message = self.message
+            view = message if type(message) is memoryview else memoryview(message)
+            self._frame = Frame(view[self.frame_offset:])
+        return self._frame
+
+    @property
+    def sim_time(self):
+        """time the simulation sent the frame, in seconds"""
+        return self.timestamp * SIM_TIMESTAMP_UNIT
+
+def parse_packet(data, offset=0):
     # frame format:
     # - node_id (2 bytes)
     # - num_good_nodes (2 bytes)
     # - good_node * num_good_nodes (n * 2 bytes)
     # - num_bad_nodes (2 bytes)
     # - bad_node * num_bad_nodes (n * 2 bytes)
-    # - misc.data
-    good_nodes = []
-    bad_nodes = []
-
-    node, = struct.unpack(">H", data[:2])
-
-    offset = 2
-
-    num_good_nodes, = struct.unpack(">H", data[offset:offset + 2])
-    offset += 2
-    for x in range(num_good_nodes):
-        good_nodes.append(struct.unpack(">H", data[offset:offset + 2])[0])
-        offset +=  2
-
-    num_bad_nodes, = struct.unpack(">H", data[offset:offset + 2])
-    offset += 2
-    for x in range(num_bad_nodes):
-        bad_nodes.append(struct.unpack(">H", data[offset:offset + 2])[0])
-        offset += 2
-
-    return {'node': node,
-            'good_nodes': good_nodes,
-            'bad_nodes': bad_nodes,
-            'timestamp': data[offset:offset+8],
-            'data': data[offset+8:]}
-
-def parse_onenode(data):
-    d_format = "!BH"
-    subtype, node_id= struct.unpack(d_format, data[:struct.calcsize(d_format)])
-    data = data[struct.calcsize(d_format):]
-    PRINT("parsing a one node event for node %d" % node_id)
-    return { 'subtype': subtype, 'nodes': [node_id], 'data': data }
-
-def parse_twonodes(data):
-    d_format = "!BHH"
-    subtype, node_a_id, node_b_id = struct.unpack(d_format, data[:struct.calcsize(d_format)])
-    data = data[struct.calcsize(d_format):]
-    PRINT("parsing a two nodes event between node %d and node %d" % (node_a_id, node_b_id))
-    return { 'subtype': subtype, 'nodes': [node_a_id, node_b_id], 'data': data }
-
-def parse_manynodes(data):
-    d_format = "!BH"
-    subtype, n_nodes = struct.unpack(d_format, data[:struct.calcsize(d_format)])
-    nodes = []
-    offset = struct.calcsize(d_format)
-
-    for node in xrange(n_nodes):
-        (node_id,) = struct.unpack("!H", data[offset + node*2: offset + node*2 +2])
-        nodes.append(node_id)
-
-    data = data[offset + node*2 + 2:]
-    PRINT("parsing a many nodes event")
-    return { 'subtype': subtype, 'nodes': nodes, 'data': data }
+    # - timestamp (8 bytes)
+    # - IEEE 802.15.4 frame
+    node, num_good_nodes = packet_header.unpack_from(data, offset)
+    offset += packet_header.size
+    fields = good_nodes_formats[num_good_nodes].unpack_from(data, offset)
+    good_nodes = list(fields[:-1])
+    num_bad_nodes = fields[-1]
+    offset += 2 * num_good_nodes + node_count.size
+
+    fields = bad_nodes_formats[num_bad_nodes].unpack_from(data, offset)
+    bad_nodes = list(fields[:-1])
+    offset += 2 * num_bad_nodes + sim_timestamp.size
+
+    return Packet(node, good_nodes, bad_nodes, fields[-1], data, offset)
+
+def unpack_nodes(data, offset, n_nodes):
+    """decode a list of n_nodes node identifiers in a single call"""
+    return list(node_list_formats[n_nodes].unpack_from(data, offset))
+
+def parse_onenode(data, offset=0):
+    subtype, node_id = onenode_header.unpack_from(data, offset)
+    if tools.verbose:
+        PRINT("parsing a one node event for node %d" % node_id)
+    # the trailing data is copied, data can be a memoryview on a receive buffer
+    rest = data[offset + onenode_header.size:]
+    return { 'subtype': subtype, 'nodes': [node_id],
+             'data': rest.tobytes() if type(rest) is memoryview else rest }
+
+def parse_twonodes(data, offset=0):
+    subtype, node_a_id, node_b_id = twonodes_header.unpack_from(data, offset)
+    if tools.verbose:
+        PRINT("parsing a two nodes event between node %d and node %d" % (node_a_id, node_b_id))
+    rest = data[offset + twonodes_header.size:]
+    return { 'subtype': subtype, 'nodes': [node_a_id, node_b_id],
+             'data': rest.tobytes() if type(rest) is memoryview else rest }
 
+def parse_manynodes(data, offset=0):
+    subtype, n_nodes = manynodes_header.unpack_from(data, offset)
+    offset += manynodes_header.size
+    nodes = unpack_nodes(data, offset, n_nodes)
+    if tools.verbose:
+        PRINT("parsing a many nodes event")
+    rest = data[offset + 2 * n_nodes:]
+    return { 'subtype': subtype, 'nodes': nodes,
+             'data': rest.tobytes() if type(rest) is memoryview else rest }
@@ -0,0 +1,272 @@
+"""multi-process logging pipeline, for simulations whose message rate
+exceeds what a single process can parse and format
+
+the receiving process hands the log messages to a pool of worker processes
+through shared memory ring buffers. Messages are sharded by node identifier
+(the first node of the message), workers parse and format them, and a merger
+process writes the lines in the order the messages were received.
+
+the workers publish their decoding counters (DispatchTable.failures and the
+unknown sub-types) in shared memory after each batch, the receiving process
+adds them up when the metrics are collected."""
+import mmap, struct, time
+from multiprocessing import Process
+from multiprocessing.sharedctypes import RawArray
+from signal import signal, SIGINT, SIG_IGN
+from threading import Lock
+from parser import LOG_HEADER, TYPE_MANYNODES, TextLogger, subtypes
+from dispatch import DispatchTable
+
+# how long a process sleeps when a ring buffer is empty (or full)
+POLL_INTERVAL = 0.0005
+
+ring_positions = struct.Struct("!QQ")
+record_length = struct.Struct("!I")
+WRAP = 0xffffffff # the next record starts at the beginning of the buffer
+
+# message sent to a worker: sequence number, time elapsed since the first
+# message and size of the message
+message_header = struct.Struct("!QdH")
+# line sent back to the merger: sequence number and size of the line
+line_header = struct.Struct("!QI")
+
+node_id = struct.Struct("!H")
+
+# counters of a worker: the failures of each message type, then the unknown
+# sub-types of each entry type (in the order of ENTRY_TYPES)
+ENTRY_TYPES = sorted(subtypes)
+N_FAILURES = 256
+
+class Ring(object):
+    """single producer, single consumer ring buffer of variable size records,
+    in memory shared by the processes forked after its creation
+
+    the buffer starts with the total number of bytes written and read so far,
+    each position being only updated by one side"""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.memory = mmap.mmap(-1, ring_positions.size + capacity)
+        self.write_pos = 0 # local copies of the positions owned by each side
+        self.read_pos = 0
+
+    def positions(self):
+        return ring_positions.unpack_from(self.memory, 0)
+
+    def depth(self):
+        """return the number of bytes written but not read yet"""
+        write_pos, read_pos = self.positions()
+        return write_pos - read_pos
+
+    def put(self, payload):
+        """append a record, waiting for the consumer to make room if needed"""
+        size = record_length.size + len(payload)
+        capacity = self.capacity
+        if size > capacity:
+            raise ValueError("record of %d bytes does not fit in the ring buffer" % size)
+        while True:
+            write_pos = self.write_pos
+            position = write_pos % capacity
+            skip = capacity - position if position + size > capacity else 0
+            if capacity - (write_pos - self.positions()[1]) >= skip + size:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        memory = self.memory
+        if skip:
+            if skip >= record_length.size:
+                record_length.pack_into(memory, ring_positions.size + position, WRAP)
+            write_pos += skip
+            position = 0
+        start = ring_positions.size + position
+        record_length.pack_into(memory, start, len(payload))
+        memory[start + record_length.size:start + size] = payload
+        self.write_pos = write_pos + size
+        # publish the record once it is complete
+        struct.pack_into("!Q", memory, 0, self.write_pos)
+
+    def get(self):
+        """return the next record, or None if the buffer is empty"""
+        capacity = self.capacity
+        memory = self.memory
+        while True:
+            read_pos = self.read_pos
+            if read_pos == self.positions()[0]:
+                return None
+            position = read_pos % capacity
+            if capacity - position < record_length.size:
+                self.read_pos += capacity - position
+                continue
+            start = ring_positions.size + position
+            length, = record_length.unpack_from(memory, start)
+            if length == WRAP:
+                self.read_pos += capacity - position
+                continue
+            start += record_length.size
+            payload = memory[start:start + length]
+            self.read_pos = read_pos + record_length.size + length
+            struct.pack_into("!Q", memory, 8, self.read_pos)
+            return payload
+
+def publish_counters(counters, table):
+    counters[:N_FAILURES] = table.failures
+    counters[N_FAILURES:] = [subtypes[entry_type].unknown for entry_type in ENTRY_TYPES]
+
+def worker(in_ring, out_ring, counters):
+    """parse and format the messages of a shard"""
+    signal(SIGINT, SIG_IGN) # the receiving process decides when to stop
+    formatter = TextLogger(None)
+    lines = []
+    current = [0, 0.] # sequence number and elapsed time of the message
+    table = DispatchTable()
+    table.subscribe(lambda entry: lines.append(
+                        (current[0], formatter.format(entry, current[1]))), LOG_HEADER)
+    header_size = message_header.size
+    while True:
+        payload = in_ring.get()
+        if payload is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        if not payload: # end of the simulation
+            out_ring.put("")
+            return
+        offset = 0
+        end = len(payload)
+        while offset < end:
+            seq, elapsed, size = message_header.unpack_from(payload, offset)
+            offset += header_size
+            current[0], current[1] = seq, elapsed
+            n_lines = len(lines)
+            table.dispatch(payload[offset:offset + size])
+            if len(lines) == n_lines: # the message could not be parsed
+                lines.append((seq, ""))
+            offset += size
+        publish_counters(counters, table)
+        out_ring.put("".join([line_header.pack(seq, len(line)) + line
+                              for seq, line in lines]))
+        del lines[:]
+
+def merger(out_rings, filename):
+    """write the lines of all the workers in order"""
+    signal(SIGINT, SIG_IGN)
+    if isinstance(filename, str):
+        fd = open(filename, mode='w')
+    else: # if we pass a file descriptor directly
+        fd = filename
+    pending = {}
+    next_seq = 0
+    running = len(out_rings)
+    header_size = line_header.size
+    while running or pending:
+        received = False
+        for ring in out_rings:
+            payload = ring.get()
+            if payload is None:
+                continue
+            received = True
+            if not payload:
+                running -= 1
+                continue
+            offset = 0
+            end = len(payload)
+            while offset < end:
+                seq, size = line_header.unpack_from(payload, offset)
+                offset += header_size
+                pending[seq] = payload[offset:offset + size]
+                offset += size
+
+        lines = []
+        while next_seq in pending:
+            lines.append(pending.pop(next_seq))
+            next_seq += 1
+        if lines:
+            fd.write("".join(lines))
+            fd.flush()
+        elif not received:
+            if not running: # lines that will never come
+                break
+            time.sleep(POLL_INTERVAL)
+    fd.flush()
+
+class ShardedLogger(object):
+    """write log messages to a file through a pool of worker processes
+
+    submit() takes raw LOG_HEADER messages, they are handed to the workers
+    on flush()"""
+    def __init__(self, filename, workers, ring_size=16 * 1024 * 1024):
+        self.in_rings = [Ring(ring_size) for i in xrange(workers)]
+        out_rings = [Ring(ring_size) for i in xrange(workers)]
+        self.counters = [RawArray('L', N_FAILURES + len(ENTRY_TYPES)) for i in xrange(workers)]
+        self.processes = [Process(target=worker, args=(in_ring, out_ring, counters),
+                                  name="logger worker %d" % i)
+                          for i, (in_ring, out_ring, counters)
+                          in enumerate(zip(self.in_rings, out_rings, self.counters))]
+        self.processes.append(Process(target=merger, args=(out_rings, filename),
+                                      name="logger merger"))
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+        self.pending = [[] for i in xrange(workers)]
+        self.seq = 0
+        self.start_time = None
+        self.lock = Lock() # close() can be called from another thread
+        self.closed = False
+
+    def shard(self, data):
+        """return the worker in charge of a message"""
+        try:
+            if ord(data[1]) == TYPE_MANYNODES: # the first node follows the number of nodes
+                node, = node_id.unpack_from(data, 5)
+            else:
+                node, = node_id.unpack_from(data, 3)
+        except (struct.error, IndexError):
+            return 0
+        return node % len(self.pending)
+
+    def submit(self, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if not self.start_time:
+            self.start_time = timestamp
+        data = data.tobytes() if type(data) is memoryview else data
+        self.pending[self.shard(data)].append(
+                message_header.pack(self.seq, timestamp - self.start_time, len(data)) + data)
+        self.seq += 1
+
+    def queue_depths(self):
+        """return the number of bytes waiting to be handled by each worker"""
+        return [ring.depth() + sum(map(len, messages))
+                for ring, messages in zip(self.in_rings, self.pending)]
+
+    def failures(self):
+        """return the number of messages the workers could not decode, for
+        each message type"""
+        return [sum(counters[m_type] for counters in self.counters)
+                for m_type in xrange(N_FAILURES)]
+
+    def unknown_subtypes(self):
+        """return the number of log entries of an unknown sub-type the workers
+        parsed, indexed by entry type"""
+        return dict((entry_type, sum(counters[N_FAILURES + i] for counters in self.counters))
+                    for i, entry_type in enumerate(ENTRY_TYPES))
+
+    def flush(self):
+        with self.lock:
+            if self.closed:
+                return
+            for ring, messages in zip(self.in_rings, self.pending):
+                if messages:
+                    ring.put("".join(messages))
+                    del messages[:]
+
+    def close(self):
+        """hand the pending messages to the workers and wait for all the
+        lines to be written"""
+        self.flush()
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for ring in self.in_rings:
+                ring.put("")
+        for process in self.processes:
+            process.join()
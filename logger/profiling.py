@@ -0,0 +1,109 @@
+"""sampled timing of the stages of a processing loop (receive, parse,
+dispatch, sinks...), written as collapsed stacks
+
+only one iteration of the loop out of sample_interval is timed, so that the
+stages can be profiled in production at a small cost. The output has one line
+per stack of stages, followed by the time spent in the stage itself (in
+microseconds, excluding the nested stages), which is the input format of
+flame graph tools, e.g. flamegraph.pl profile.txt > profile.svg
+
+Python 2 provides no nanosecond performance counter, stages are timed with
+time.time() (microsecond resolution on Linux), which is accurate enough once
+many samples are added up"""
+import time
+from signal import signal, siginterrupt, SIGUSR1
+
+class StageProfiler(object):
+    """time the stages of one iteration of a loop out of sample_interval
+
+    sample() is called at the start of each iteration, the stages are the
+    functions returned by wrap(), stages called by another stage are nested
+    in it. The stacks are written to filename by dump(), which happens at the
+    start of the next iteration after a SIGUSR1 when install() was called"""
+    def __init__(self, root, filename, sample_interval=100):
+        self.root = root
+        self.filename = filename
+        self.sample_interval = sample_interval
+        self.countdown = 0
+        self.sampling = False
+        self.samples = 0
+        self.stack = [] # [path, start time, time spent in nested stages]
+        self.times = {} # path to the time spent in the stage itself
+        self.dump_requested = False
+
+    def install(self):
+        """dump the stacks on SIGUSR1 (without interrupting system calls)"""
+        signal(SIGUSR1, self.request_dump)
+        siginterrupt(SIGUSR1, False)
+
+    def request_dump(self, signum, frame):
+        self.dump_requested = True
+
+    def sample(self):
+        """start an iteration of the loop"""
+        if self.dump_requested:
+            self.dump_requested = False
+            self.dump()
+        self.countdown -= 1
+        self.sampling = self.countdown <= 0
+        if self.sampling:
+            self.countdown = self.sample_interval
+            self.samples += 1
+
+    def wrap(self, stage, function):
+        """return a function that calls function as a stage named stage"""
+        stack = self.stack
+        clock = time.time
+        def timed(*args):
+            if not self.sampling:
+                return function(*args)
+            path = (stack[-1][0] if stack else self.root) + ";" + stage
+            frame = [path, clock(), 0.]
+            stack.append(frame)
+            try:
+                return function(*args)
+            finally:
+                elapsed = clock() - frame[1]
+                stack.pop()
+                self.times[path] = self.times.get(path, 0.) + elapsed - frame[2]
+                if stack:
+                    stack[-1][2] += elapsed
+        return timed
+
+    def wrap_always(self, stage, function):
+        """return a function that times every call of function as a top-level
+        stage, for functions running in another thread (e.g. a flusher)"""
+        path = self.root + ";" + stage
+        clock = time.time
+        def timed(*args):
+            start = clock()
+            try:
+                return function(*args)
+            finally:
+                self.times[path] = self.times.get(path, 0.) + clock() - start
+        return timed
+
+    def instrument(self, dispatch_table):
+        """turn the parsers and the handlers of a dispatch table into stages,
+        should be called once all the handlers are subscribed"""
+        for route in dispatch_table.table.itervalues():
+            if route.parser:
+                route.parser = self.wrap(stage_name(route.parser), route.parser)
+            route.handlers = [self.wrap(stage_name(handler), handler)
+                              for handler in route.handlers]
+
+    def dump(self):
+        """write the collapsed stacks (microseconds spent in each stage)"""
+        with open(self.filename, mode='w') as fd:
+            for path, elapsed in sorted(self.times.items()):
+                fd.write("%s %d\n" % (path, round(elapsed * 1e6)))
+
+def stage_name(function):
+    """name of the stage of a function: class.method for methods"""
+    name = getattr(function, "__name__", "handler")
+    if name == "<lambda>":
+        name = "handler"
+    owner = getattr(function, "im_self", None)
+    if owner is not None:
+        name = "%s.%s" % (type(owner).__name__, name)
+    return name
@@ -0,0 +1,157 @@
+"""replay of recorded simulation sessions (binary logs)"""
+import mmap, select, socket, time
+from array import array
+from bisect import bisect_left
+from errno import EAGAIN, EINTR
+from binlog import check_file_header, file_header, record_header
+
+class ReplaySource(object):
+    """deliver the datagrams of a binary log as they were received during
+    the simulation, speed times faster (or as fast as possible if speed is
+    None)
+
+    a ReplaySource can be used in place of a non-blocking socket (recvfrom())
+    or of a BatchReceiver (receive()), in which case the timestamps list holds
+    the time the datagrams were originally received"""
+    def __init__(self, filename, speed=1.0, batch_size=64):
+        self.speed = speed
+        self.batch_size = batch_size
+        self.fd = open(filename, mode='rb')
+        check_file_header(self.fd, filename)
+        self.fd.seek(0, 2)
+        if self.fd.tell() > file_header.size:
+            self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        else: # mmap does not handle empty files
+            self.data = ""
+        # time (relative to the first record) and offset of each record
+        self.times = array('d')
+        self.offsets = array('L')
+        self.first_time = None # time the first record was received
+        self.timestamps = []
+        self.scan()
+        self.position = 0
+        self.burst = 0 # datagrams returned by recvfrom() since the last EAGAIN
+        self.replayed = 0
+        self.bytes = 0
+        self.started = None # the clock of the replay starts with the first read
+        self.clock_start = 0.
+        self.wall_start = None
+
+    def scan(self):
+        """locate the records (only their headers are read)"""
+        data = self.data
+        unpack_from = record_header.unpack_from
+        header_size = record_header.size
+        offset = file_header.size
+        end = len(data)
+        while offset + header_size <= end:
+            size, timestamp, m_type, entry_type, subtype = unpack_from(data, offset)
+            if offset + header_size + size > end: # truncated record
+                break
+            if self.first_time is None:
+                self.first_time = timestamp
+            self.times.append(timestamp - self.first_time)
+            self.offsets.append(offset)
+            offset += header_size + size
+
+    @property
+    def packets(self):
+        """number of datagrams delivered (as counted by a BatchReceiver)"""
+        return self.replayed
+
+    @property
+    def duration(self):
+        return self.times[-1] if self.times else 0.
+
+    def now(self):
+        """return the current position of the replay (in seconds since the
+        first record)"""
+        if self.speed is None: # the time of the next record
+            return self.duration if self.finished() else self.times[self.position]
+        if self.started is None:
+            return self.clock_start
+        return self.clock_start + (time.time() - self.wall_start) * self.speed
+
+    def start(self):
+        """start the clock of the replay, on the first read"""
+        self.started = self.wall_start = time.time()
+
+    def seek(self, position):
+        """move the replay to position (in seconds since the first record)"""
+        position = min(max(position, 0.), self.duration)
+        self.position = bisect_left(self.times, position)
+        self.clock_start = position
+        self.wall_start = time.time()
+
+    def skip(self, delta):
+        """move the replay delta seconds forward (or backward)"""
+        self.seek(self.now() + delta)
+
+    def finished(self):
+        return self.position >= len(self.offsets)
+
+    def next_datagram(self):
+        offset = self.offsets[self.position] + record_header.size
+        size = record_header.unpack_from(self.data, self.offsets[self.position])[0]
+        self.position += 1
+        self.replayed += 1
+        self.bytes += size
+        return self.data[offset:offset + size]
+
+    def is_due(self):
+        return self.times[self.position] <= self.now()
+
+    def recvfrom(self, bufsize):
+        """return the next datagram if it is due, or raise socket.error
+        (EAGAIN), like a non-blocking socket would
+
+        when replaying as fast as possible, EAGAIN is raised every batch_size
+        datagrams so that the caller gets a chance to do something else"""
+        if self.started is None:
+            self.start()
+        if self.finished() or not self.is_due() or \
+           (self.speed is None and self.burst >= self.batch_size):
+            self.burst = 0
+            raise socket.error(EAGAIN, "no datagram is due")
+        self.burst += 1
+        return self.next_datagram()[:bufsize], None
+
+    def setblocking(self, flag):
+        pass
+
+    def receive(self):
+        """wait for the next datagram to be due and return it along with all
+        the datagrams already due, up to batch_size datagrams
+
+        an empty datagram is returned once the whole session has been
+        replayed"""
+        if self.started is None:
+            self.start()
+        if self.finished():
+            self.timestamps = [None]
+            return [""]
+        delay = (self.times[self.position] - self.now()) / self.speed \
+                if self.speed is not None else 0
+        if delay > 0:
+            try:
+                select.select([], [], [], delay)
+            except select.error, e: # interrupted by a signal
+                raise socket.error(e.args[0] if e.args else EINTR, "interrupted")
+        datagrams = []
+        timestamps = self.timestamps = []
+        while not self.finished() and len(datagrams) < self.batch_size and self.is_due():
+            timestamps.append(self.first_time + self.times[self.position])
+            datagrams.append(self.next_datagram())
+        return datagrams
+
+    def stats(self):
+        """return a one-line summary of the replay"""
+        elapsed = time.time() - self.started if self.started else 0.
+        rate = self.replayed / elapsed if elapsed else 0.
+        return "%d datagrams replayed in %.3f seconds (%.0f datagrams/s)" % \
+                (self.replayed, elapsed, rate)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.fd.close()
@@ -0,0 +1,172 @@
+"""simulation time of the data frames: reordering of the frames and latency
+between the simulation and the logger
+
+each data frame carries the time the simulation sent it. Frames of different
+nodes can reach the logger out of order (e.g. when the simulation runs on
+several threads or hosts), and they reach it some time after they were sent
+(the multicast path and the logger itself add delays)."""
+import heapq, time
+from itertools import count
+
+class ReorderBuffer(object):
+    """hand items to handler in the order of their simulation time
+
+    items are held until an item at least window seconds (of simulation time)
+    more recent arrives, or until no item arrived for window seconds (of wall
+    clock time, see release()). At most max_size items are held, the oldest
+    ones being released first when the buffer is full. Items that arrive after
+    a more recent item has been released are handed to handler right away
+    (and counted as late)
+
+    items must stay valid while they are held (e.g. they must not reference a
+    receive buffer that is reused)"""
+    def __init__(self, handler, window=0.1, max_size=65536):
+        self.handler = handler
+        self.window = window
+        self.max_size = max_size
+        self.heap = []
+        self.sequence = count() # keeps items of the same time in arrival order
+        self.newest = None # most recent simulation time seen so far
+        self.released = None # simulation time of the last item released
+        self.last_push = None
+        self.late = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, sim_time, item):
+        self.last_push = time.time()
+        if self.released is not None and sim_time < self.released:
+            self.late += 1 # too late to be put back in order
+            self.handler(item)
+            return
+        heap = self.heap
+        heapq.heappush(heap, (sim_time, next(self.sequence), item))
+        if self.newest is None or sim_time > self.newest:
+            self.newest = sim_time
+        watermark = self.newest - self.window
+        while heap and (heap[0][0] <= watermark or len(heap) > self.max_size):
+            self.pop()
+
+    def pop(self):
+        sim_time, sequence, item = heapq.heappop(self.heap)
+        self.released = sim_time
+        self.handler(item)
+
+    def release(self, now=None):
+        """release all the items if none arrived for window seconds, should
+        be called periodically so that items are not held forever when the
+        simulation stops sending"""
+        if not self.heap:
+            return
+        if now is None:
+            now = time.time()
+        if now - self.last_push >= self.window:
+            self.flush()
+
+    def flush(self):
+        """release all the items"""
+        while self.heap:
+            self.pop()
+
+class LatencyHistogram(object):
+    """distribution of latencies, in power of two buckets of microseconds
+
+    bucket 0 counts the latencies below 1 microsecond, bucket i those between
+    2^(i-1) and 2^i microseconds. Negative latencies (the clocks of the
+    simulation and of the logger are not synchronized) are only counted"""
+    BUCKETS = 40 # up to 2^39 microseconds (about 6 days)
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.negative = 0
+
+    def add(self, latency):
+        """record a latency (in seconds)"""
+        if latency < 0:
+            self.negative += 1
+            return
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+        bucket = int(latency * 1e6).bit_length()
+        self.counts[min(bucket, self.BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        """add the latencies of another histogram to this one"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.negative += other.negative
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def percentile(self, percent):
+        """return an upper bound of the given percentile (in seconds), that is
+        the upper bound of the bucket it falls into"""
+        if not self.count:
+            return 0.
+        rank = self.count * percent / 100.
+        seen = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                break
+        return min((1 << bucket) * 1e-6, self.max)
+
+    def summary(self):
+        """return a one-line summary of the distribution (in milliseconds)"""
+        line = "%d frames, mean %.3f ms, p50 <= %.3f ms, p99 <= %.3f ms, max %.3f ms" % \
+               (self.count, self.mean() * 1e3, self.percentile(50) * 1e3,
+                self.percentile(99) * 1e3, self.max * 1e3)
+        if self.negative:
+            line += ", %d frames received before being sent (unsynchronized clocks)" % \
+                    self.negative
+        return line
+
+class LatencyMonitor(object):
+    """latency between the time the simulation sent the data frames and the
+    time the logger received them, per sending node
+
+    packet() is a handler for OUTBOUND_FRAME messages. The latency of the
+    logger itself (from the time a frame is sent to the time it is handled)
+    is also recorded, for all the nodes at once, unless processing is unset
+    (e.g. when replaying a recorded session, which is handled long after it
+    was sent)"""
+    def __init__(self, processing=True):
+        self.nodes = {} # node identifier to LatencyHistogram
+        self.processing = LatencyHistogram() if processing else None
+
+    def packet(self, packet):
+        now = time.time()
+        sent = packet.sim_time
+        received = packet.time if packet.time is not None else now
+        try:
+            histogram = self.nodes[packet.node]
+        except KeyError:
+            histogram = self.nodes[packet.node] = LatencyHistogram()
+        histogram.add(received - sent)
+        if self.processing is not None:
+            self.processing.add(now - sent)
+
+    def summary(self):
+        """return a summary of the receive and processing latencies (one line
+        each)"""
+        received = LatencyHistogram()
+        for histogram in self.nodes.itervalues():
+            received.merge(histogram)
+        if self.processing is None:
+            return "receive latency: %s" % received.summary()
+        return "receive latency: %s\nprocessing latency: %s" % \
+               (received.summary(), self.processing.summary())
+
+    def report(self):
+        """return the receive latency of each node (one line per node)"""
+        return "\n".join(["node %d: %s" % (node, self.nodes[node].summary())
+                          for node in sorted(self.nodes)])
@@ -2,6 +2,9 @@
 
 verbose = False
 
+# functions called right before the process exits on a simulation end
+exit_handlers = []
+
 def PRINT(* args):
     """a more verbose print"""
     if verbose:
@@ -13,7 +16,26 @@ def set_verbose(status):
     global verbose
     verbose = status
 
+def at_simulation_end(handler):
+    """register a function to be called before exiting on a simulation end
+    (e.g. to write buffered data)"""
+    exit_handlers.append(handler)
+
 def simulation_end():
+    for handler in exit_handlers:
+        handler()
     print "logger is now exiting"
     import os
     os._exit(0)
+
+class prettyfile(object):
+    """a class of file that prints out nicely when str() or repr() is called"""
+    fileobj = None
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+    def __str__(self):
+        return self.fileobj.name
+    def write(self, data):
+        self.fileobj.write(data)
+    def flush(self):
+        self.fileobj.flush()
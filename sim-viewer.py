@@ -34,6 +34,8 @@ import time, os
 
 from viewer.entities import SensorMap, Node
 from viewer.dispatcher import Dispatcher
+from logger.replay import ReplaySource
+from logger.profiling import StageProfiler
 import viewer.entities
 from logger.tools import set_verbose
 import logger.tools
@@ -52,6 +54,7 @@ on_resize_event_obj = []
 on_mouse_motion_event_obj = []
 
 sensor_map = None
+replay = None
 
 @sim_window.event
 def on_draw():
@@ -76,6 +79,10 @@ def on_key_press(symbol, modifiers):
         sensor_map.view_trans(10, 0)
     elif symbol == key.R:
         sensor_map.reset_view()
+    elif symbol == key.PAGEUP and replay:
+        replay.skip(10)
+    elif symbol == key.PAGEDOWN and replay:
+        replay.skip(-10)
 
 @sim_window.event
 def on_mouse_scroll(x, y, scroll_x, scroll_y):
@@ -103,7 +110,7 @@ def on_mouse_motion(x, y, dx, dy):
         obj.on_mouse_motion(x, y, dx, dy)
 
 def update(dt):
-    pass
+    sensor_map.update(dt)
 
 # XML related code
 def parse_xml(filename):
@@ -125,6 +132,12 @@ if __name__ == "__main__":
     parser.add_argument("-f", "--filename", help="simulation file", type=str, default="simulation.xml")
     parser.add_argument("-a", "--mcast-addr", help="IP address of the multicast group", default="224.1.1.1")
     parser.add_argument("-p", "--mcast-port", help="port to listen on (for the multicast address)", type=int, default=10000)
+    parser.add_argument("-R", "--replay", help="replay a binary log instead of listening to the multicast group", type=str, default=None)
+    parser.add_argument("-S", "--speed", help="replay speed factor (0 replays as fast as possible)", type=float, default=1.)
+    parser.add_argument("-s", "--start", help="start the replay at START seconds", type=float, default=0.)
+    parser.add_argument("-o", "--reorder", help="animate the data frames in the order the simulation sent them, holding them up to REORDER seconds (in the order they are received if unset)", type=float, default=None)
+    parser.add_argument("-P", "--profile", help="time the stages of the processing of the messages (receive, parse, dispatch, animation) and write them to PROFILE as collapsed stacks, on exit and on SIGUSR1", type=str, default=None)
+    parser.add_argument("-I", "--profile-interval", help="time one processing round (every 1/60 s) out of PROFILE_INTERVAL", type=int, default=10)
     parser.add_argument("-v", "--verbose", help="make this tool more verbose", action="store_true")
 
     args = parser.parse_args()
@@ -140,7 +153,14 @@ if __name__ == "__main__":
     viewer.entities.init()
 
     sensor_map = SensorMap()
-    graphic_dispatch = Dispatcher(args.mcast_addr, args.mcast_port, sensor_map)
+    if args.replay:
+        replay = ReplaySource(args.replay, speed=args.speed or None)
+        replay.seek(args.start)
+    profiler = None
+    if args.profile:
+        profiler = StageProfiler("viewer", args.profile, args.profile_interval)
+    graphic_dispatch = Dispatcher(args.mcast_addr, args.mcast_port, sensor_map, source=replay,
+                                  reorder_window=args.reorder, profiler=profiler)
     on_mouse_motion_event_obj.append(sensor_map)
     on_resize_event_obj.append(sensor_map)
     for (identifier, x, y)  in nodes:
@@ -154,3 +174,6 @@ if __name__ == "__main__":
     pyglet.clock.schedule_interval(update, 1/60.)
 
     pyglet.app.run()
+
+    if profiler:
+        profiler.dump()
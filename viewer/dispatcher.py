@@ -1,29 +1,63 @@
 import pyglet
-import socket, struct
+import socket
 
 from logger.network import multicast_listener
-from logger.parser import LOG_HEADER, OUTBOUND_FRAME,\
-                          parse_packet, \
-                          parse_onenode, parse_twonodes, parse_manynodes, \
-                          TYPE_ONENODE, TYPE_TWONODES, TYPE_MANYNODES
+from logger.parser import LOG_HEADER, OUTBOUND_FRAME
+from logger.dispatch import DispatchTable
 from logger.tools import PRINT
-from logger.framer import IEEE802154Framer
+from logger.framer import FrameError
+from logger.simtime import ReorderBuffer
+from logger.profiling import stage_name
 from entities import S_GREEN, S_LIGHT_BLUE, S_RED, \
                      TRANSPARENT_RED, TRANSPARENT_GREEN, TRANSPARENT_GREY, \
                      HARD_GREY, HARD_RED, HARD_BLUE
 
 class Dispatcher(object):
-    def __init__(self, address, port, sensor_map):
+    def __init__(self, address, port, sensor_map, dispatch_table=None, source=None,
+                 reorder_window=None, profiler=None):
+        """dispatch_table can be shared with other consumers (e.g. a logger)
+        so that each message is only decoded once
+
+        source replaces the multicast socket (e.g. a ReplaySource), it must
+        provide recvfrom() and raise socket.error when it has no datagram
+
+        when reorder_window is set, data frames are animated in the order the
+        simulation sent them, frames being held up to reorder_window seconds
+
+        profiler is an optional StageProfiler timing the stages of
+        process_packet()"""
         self.sensor_map = sensor_map
-        self.sock = multicast_listener(address, port)
+        self.sock = source or multicast_listener(address, port)
         self.sock.setblocking(False)
+        self.dispatch_table = dispatch_table or DispatchTable()
+        self.dispatch_table.subscribe(self.animate_log, LOG_HEADER)
+        self.reorder = None
+        if reorder_window:
+            self.reorder = ReorderBuffer(self.animate_packet, reorder_window)
+            self.dispatch_table.subscribe(self.reorder_packet, OUTBOUND_FRAME)
+        else:
+            self.dispatch_table.subscribe(self.animate_packet, OUTBOUND_FRAME)
+        self.recvfrom = self.sock.recvfrom
+        self.profiler = profiler
+        if profiler:
+            profiler.instrument(self.dispatch_table)
+            if self.reorder:
+                self.reorder.handler = profiler.wrap(stage_name(self.animate_packet),
+                                                     self.animate_packet)
+            self.recvfrom = profiler.wrap("recvfrom", self.recvfrom)
+            self.dispatch = profiler.wrap("dispatch", self.dispatch)
+            profiler.install()
         pyglet.clock.schedule_interval(self.process_packet, 1./60)
 
     def process_packet(self, dt):
+        if self.profiler:
+            self.profiler.sample()
+        if self.reorder:
+            self.reorder.release()
         data = True
         while data:
             try:
-                data, addr = self.sock.recvfrom(65535)
+                data, addr = self.recvfrom(65535)
             except socket.error: # if the socket is empty
                 return
 
@@ -31,47 +65,20 @@ class Dispatcher(object):
                 self.dispatch(data)
 
     def dispatch(self, data):
-        if ord(data[0]) == LOG_HEADER:
-            PRINT("parsing log message")
-            self.dispatch_log(data)
-        elif ord(data[0]) == OUTBOUND_FRAME:
-            PRINT("parsing data frame")
-            self.dispatch_packet(data)
-
-    def dispatch_packet(self, data):
-        if len(data) <= 4:
-            return
-        self.animate_packet(parse_packet(data[1:]))
+        self.dispatch_table.dispatch(data)
 
-    def dispatch_log(self, data):
-        if len(data) <= 4:
-            return
+    def reorder_packet(self, packet):
+        self.reorder.push(packet.sim_time, packet)
 
-        # log the event accordingly
-        m_type = ord(data[1])
+    def animate_packet(self, packet):
+        node = packet.node
+        good_nodes = packet.good_nodes
+        bad_nodes = packet.bad_nodes
         try:
-            if m_type == TYPE_ONENODE:
-                log_entry = parse_onenode(data[2:])
-            elif m_type == TYPE_TWONODES:
-                log_entry = parse_twonodes(data[2:])
-            elif m_type == TYPE_MANYNODES:
-                log_entry = parse_manynodes(data[2:])
-            else:
-                PRINT("message type %d is not recognized")
-                return
-            log_entry['type'] = m_type
-        except struct.error:
-            PRINT("could not parse message of type %d" % m_type)
+            payload_type = packet.frame.payload_type
+        except FrameError:
+            PRINT("could not parse the frame sent by node %d" % node)
             return
-
-        self.animate_log(log_entry)
-
-    def animate_packet(self, packet_info):
-        node = packet_info['node']
-        good_nodes = packet_info['good_nodes']
-        bad_nodes = packet_info['bad_nodes']
-        offset = IEEE802154Framer(packet_info['data']).compute_mac_payload_offset()
-        payload_type = ord(packet_info['data'][offset])
         if payload_type == 0x47: # AKM
             good_color = TRANSPARENT_RED
         else:
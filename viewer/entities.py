@@ -1,7 +1,13 @@
 """Contains the various entities that will be displayed during the simulation"""
 import pyglet
-import math
+import heapq, math, time
+from collections import OrderedDict
 from trig_tools import compute_angle, compute_arrow_points
+from spatial import GridIndex
+try:
+    import geometry
+except ImportError: # NumPy is not installed
+    geometry = None
 
 batch = None
 
@@ -25,6 +31,15 @@ S_GREEN = (50, 200, 50)
 S_BLUE  = (50, 50, 200)
 S_LIGHT_BLUE  = (120, 120, 255)
 
+def node_key(identifier):
+    """return the key of a node in a SensorMap: its simulation identifier as
+    an integer (identifiers read from the simulation file are strings), or the
+    identifier itself if it is not a number"""
+    try:
+        return int(identifier)
+    except (TypeError, ValueError):
+        return identifier
+
 class Layers(object):
     """class that contains displayable layers"""
     background   = pyglet.graphics.OrderedGroup(0)
@@ -107,6 +122,8 @@ class SensorNode(pyglet.sprite.Sprite):
         self.overlay = None
         self.center_x = self.node_img.width/2
         self.center_y = self.node_img.height/2
+        self.size = self.compute_bounding_box()
+        self.box = (0, 0) + self.size # bounding box on the screen
 
     def get_scale(self):
         return self._scale
@@ -116,6 +133,7 @@ class SensorNode(pyglet.sprite.Sprite):
         self.node_status.scale = value
         self.center_x = self.node_img.width/2
         self.center_y = self.node_img.height/2
+        self.size = self.compute_bounding_box()
     scale = property(get_scale, set_scale)
 
     @property
@@ -128,17 +146,15 @@ class SensorNode(pyglet.sprite.Sprite):
 
     @property
     def width(self):
-        width, height = self.compute_bounding_box()
-        return width
+        return self.size[0]
 
     @property
     def height(self):
-        width, height = self.compute_bounding_box()
-        return height
+        return self.size[1]
 
     def on_mouse_motion(self, x, y, dx, dy):
-        if self.node_img.x < x < self.node_img.x + self.width and  \
-           self.node_img.y < y < self.node_img.y + self.height:
+        x_min, y_min, x_max, y_max = self.box
+        if x_min < x < x_max and y_min < y < y_max:
             self.enable_overlay(str(self.node_info))
         else:
             self.disable_overlay()
@@ -161,16 +177,21 @@ class SensorNode(pyglet.sprite.Sprite):
         return (max(sizes_x), max(sizes_y))
 
     def apply_tranform(self, scale, trans_x, trans_y, view_trans_x, view_trans_y):
-        self.node_img.x = scale * (self.node_info.x + trans_x) + view_trans_x
-        self.node_img.y = scale * (self.node_info.y + trans_y) + view_trans_y
+        self.move(scale * (self.node_info.x + trans_x) + view_trans_x,
+                  scale * (self.node_info.y + trans_y) + view_trans_y)
+
+    def move(self, x, y):
+        """move the lower left corner of the node to (x, y) on the screen"""
+        self.node_img.x = x
+        self.node_img.y = y
         # the node_label must be inside the node
-        self.node_label.x = scale * (self.node_info.x + trans_x) + view_trans_x + self.center_x
-        self.node_label.y = scale * (self.node_info.y + trans_y) + view_trans_y + self.center_y
+        self.node_label.x = x + self.center_x
+        self.node_label.y = y + self.center_y
         # status is on the upper right corner of the image
-        self.node_status.x = scale * (self.node_info.x + trans_x) + view_trans_x + \
-                                    self.node_img.width - self.node_status.width
-        self.node_status.y = scale * (self.node_info.y + trans_y) + view_trans_y + \
-                                    self.node_img.height - self.node_status.height
+        self.node_status.x = x + self.node_img.width - self.node_status.width
+        self.node_status.y = y + self.node_img.height - self.node_status.height
+        width, height = self.size
+        self.box = (x, y, x + width, y + height)
 
 class SensorMap(object):
     """Display the sensor in simulation area"""
@@ -180,22 +201,40 @@ class SensorMap(object):
         self.x_max = 0
         self.y_max = 0
         self.node_scale = 0.4
-        self.lines = {}
-        self.nodes = []
+        self.lines = {} # (node A, node B) to the slot of their line in links
+        self.links = None # LineSet, created with the first line
+        self.arrows = None # ArrowPool, created with the first arrow
+        self.nodes = OrderedDict() # simulation identifier (integer) to SensorNode
+        # with NumPy: positions and sizes of the nodes (in the order of
+        # nodes) and indices of the nodes of each slot of links
+        self.positions = None
+        self.sizes = None
+        self.link_ends = None
         self.view_scale = 1
         self.view_trans_x = 0
         self.view_trans_y = 0
+        self.index = GridIndex() # screen bounding boxes of the nodes
+        self.hovered = [] # nodes displaying their overlay
 
     def add_node(self, node_info):
+        key = node_key(node_info.identifier)
+        if key in self.nodes:
+            raise Exception("node %s is already part of the simulation" % node_info.identifier)
         sensor_node = SensorNode(node_info)
         sensor_node.scale=self.node_scale
-        self.nodes.append(sensor_node)
-        self.compute_bounding_box()
+        sensor_node.index = len(self.nodes)
+        self.nodes[key] = sensor_node
+        self.positions = None
+        # the bounding box only grows when a node is added
+        self.x_min = min(self.x_min, node_info.x)
+        self.x_max = max(self.x_max, node_info.x)
+        self.y_min = min(self.y_min, node_info.y)
+        self.y_max = max(self.y_max, node_info.y)
 
     def compute_bounding_box(self):
         x_min, y_min, x_max, y_max = 0, 0, 0, 0
 
-        for node in self.nodes:
+        for node in self.nodes.itervalues():
             if node.x < x_min:
                 x_min = node.x
             if node.x > x_max:
@@ -208,14 +247,11 @@ class SensorMap(object):
         self.x_min, self.y_min, self.x_max, self.y_max = x_min, y_min, x_max, y_max
 
     def node_lookup(self, identifier):
-        """returns the node corresponding to the identifier or None if no node
-        is found"""
-        identifier = str(identifier)
-        node = None
-        for n in self.nodes:
-            if n.node_info.identifier == identifier:
-                node = n
-                break
+        """returns the node corresponding to the identifier (the integer
+        simulation identifier, or its string) or None if no node is found"""
+        node = self.nodes.get(identifier)
+        if node is None and not isinstance(identifier, (int, long)):
+            node = self.nodes.get(node_key(identifier))
         return node
 
     def node_change_color(self, identifier, color):
@@ -239,15 +275,22 @@ class SensorMap(object):
 
         if nodeA and nodeB:
             line_id = (nodeA, nodeB) if A < B else (nodeB, nodeA)
+            if self.links is None:
+                self.links = LineSet(batch)
             if self.lines.has_key(line_id):
-                if self.lines[line_id].color != color:
-                    self.lines[line_id].update_color(color)
+                slot = self.lines[line_id]
+                if self.links.colors[slot] != color:
+                    self.links.update_color(slot, color)
                 return
-            line = Line((nodeA.node_img.x + nodeA.center_x, nodeA.node_img.y + nodeA.center_y), # A position
+            slot = self.links.add(
+                        (nodeA.node_img.x + nodeA.center_x, nodeA.node_img.y + nodeA.center_y), # A position
                         (nodeB.node_img.x + nodeB.center_x, nodeB.node_img.y + nodeB.center_y), # B position
-                        color=color)
-            line.add_batch(batch)
-            self.lines[line_id] = line
+                        color)
+            self.lines[line_id] = slot
+            if geometry is not None:
+                if self.link_ends is None or len(self.link_ends) < self.links.capacity:
+                    self.link_ends = geometry.resize_ends(self.link_ends, self.links.capacity)
+                self.link_ends[slot] = [node.index for node in line_id]
         else:
             raise Exception("%s or %s is not part of the simulation" % (A, B))
 
@@ -258,8 +301,10 @@ class SensorMap(object):
         if nodeA and nodeB:
             line_id = (nodeA, nodeB) if A < B else (nodeB, nodeA)
             if self.lines.has_key(line_id):
-                self.lines[line_id].delete()
-                del self.lines[line_id]
+                slot = self.lines.pop(line_id)
+                self.links.delete(slot)
+                if geometry is not None:
+                    self.link_ends[slot] = -1
 
 
     def arrows_create(self, source, destinations, lifetime=.2, color = HARD_BLACK):
@@ -275,7 +320,9 @@ class SensorMap(object):
             coordinates.append(((A.node_img.x + A.center_x, A.node_img.y + A.center_y),
                                 (B.node_img.x + B.center_x, B.node_img.y + B.center_y)))
 
-        return ArrowGroup(coordinates, lifetime, color)
+        if self.arrows is None:
+            self.arrows = ArrowPool(batch)
+        self.arrows.add_many(coordinates, lifetime, color)
 
 
     def reset_view(self):
@@ -306,16 +353,18 @@ class SensorMap(object):
 
     def node_scale_up(self):
         self.node_scale += 0.05
-        for (i, node) in enumerate(self.nodes):
-            self.nodes[i].scale = self.node_scale
+        for node in self.nodes.itervalues():
+            node.scale = self.node_scale
+        self.positions = None # the sizes of the nodes changed
 
         self.refresh_view_with_params(self.width, self.height)
 
     def node_scale_down(self):
         if self.node_scale > 0.05:
             self.node_scale -= 0.05
-            for (i, node) in enumerate(self.nodes):
-                self.nodes[i].scale = self.node_scale
+            for node in self.nodes.itervalues():
+                node.scale = self.node_scale
+            self.positions = None # the sizes of the nodes changed
 
             self.refresh_view_with_params(self.width, self.height)
         else:
@@ -343,32 +392,52 @@ class SensorMap(object):
 
     def refresh_view_with_params(self, width, height):
         if len(self.nodes):
-            node_size_x, node_size_y = self.nodes[0].compute_bounding_box()
+            first_node = next(self.nodes.itervalues())
+            node_size_x, node_size_y = first_node.size
             scale, trans_x, trans_y = self.compute_fit_map_to_window_params(width - node_size_x,
                                                                             height - node_size_y)
             self.apply_tranform(self.view_scale * scale, trans_x, trans_y)
 
     def apply_tranform(self, scale, trans_x, trans_y):
+        if geometry is not None and self.nodes:
+            self.apply_tranform_bulk(scale, trans_x, trans_y)
+            return
         # update the nodes
-        for node in self.nodes:
+        for node in self.nodes.itervalues():
             node.apply_tranform(scale, trans_x, trans_y, self.view_trans_x, self.view_trans_y)
-        # update the lines
-        for nodes, line in self.lines.iteritems():
-            node_A, node_B = nodes
-            new_A = node_A.node_info.apply_tranform(scale,
-                                                    trans_x,
-                                                    trans_y,
-                                                    self.view_trans_x  + node_A.center_x,
-                                                    self.view_trans_y + node_A.center_y)
-            new_B = node_B.node_info.apply_tranform(scale,
-                                                    trans_x,
-                                                    trans_y,
-                                                    self.view_trans_x + node_B.center_x,
-                                                    self.view_trans_y + node_B.center_y)
-            line.update_coordinates(new_A, new_B)
+        self.index = GridIndex.build([(node.box, node) for node in self.nodes.itervalues()])
+        # update the lines at once
+        if self.lines:
+            coordinates = [0.] * (4 * self.links.capacity)
+            for (node_A, node_B), slot in self.lines.iteritems():
+                coordinates[4 * slot:4 * slot + 4] = (node_A.node_img.x + node_A.center_x,
+                                                      node_A.node_img.y + node_A.center_y,
+                                                      node_B.node_img.x + node_B.center_x,
+                                                      node_B.node_img.y + node_B.center_y)
+            self.links.set_coordinates(coordinates)
+
+    def apply_tranform_bulk(self, scale, trans_x, trans_y):
+        """apply_tranform() computing the positions of all the nodes and the
+        ends of all the lines at once (requires NumPy)"""
+        if self.positions is None:
+            self.positions = geometry.positions(self.nodes.itervalues())
+            self.sizes = geometry.sizes(self.nodes.itervalues())
+        screen = geometry.transform(self.positions, scale, trans_x, trans_y,
+                                    self.view_trans_x, self.view_trans_y)
+        nodes = self.nodes.values()
+        for node, (x, y) in zip(nodes, screen.tolist()):
+            node.move(x, y)
+        self.index = geometry.GridIndex(screen, self.sizes, nodes)
+        if self.lines:
+            # all the nodes have the same image, at the same scale
+            first_node = next(self.nodes.itervalues())
+            centers = screen + (first_node.center_x, first_node.center_y)
+            vertices = geometry.vertex_array(self.links.vertexlist.vertices, 4)
+            vertices[:] = geometry.link_vertices(centers, self.link_ends)
 
     def update(self, dt):
-        pass
+        if self.arrows is not None:
+            self.arrows.sweep()
 
     def on_resize(self, width, height):
         self.width = width
@@ -377,88 +446,159 @@ class SensorMap(object):
         self.refresh_view_with_params(width, height)
 
     def on_mouse_motion(self, x, y, dx, dy):
-        for node in self.nodes:
+        # only the nodes under the cursor and those displaying their overlay
+        # can change
+        hovered = self.index.query(x, y)
+        for node in self.hovered:
+            if node not in hovered:
+                node.disable_overlay()
+        for node in hovered:
             node.on_mouse_motion(x, y, dx, dy)
-
-class Line(object):
-    """draw a line"""
-    def __init__(self, A=(0.,0.), B=(0.,0.), color=HARD_BLACK):
-        self.A = A
-        self.B = B
-        self.color = color
-        self.vertexlist = None
-
-    def delete(self):
-        if self.vertexlist:
-            self.vertexlist.delete()
-
-    def add_batch(self, batch):
-        """draw a line"""
-        x_A, y_A = self.A
-        x_B, y_B = self.B
-        self.vertexlist = batch.add(2,pyglet.gl.GL_LINES,Layers.background,
-                                   ('v2f', (x_A, y_A, x_B, y_B)),
-                                   ('c4B', 2 * self.color))
-        return self.vertexlist
-
-    def update_coordinates(self, A, B):
-        self.A = A
-        self.B = B
-        self.delete()
-        self.add_batch(batch)
-
-    def update_color(self, color):
-        self.color = color
-        self.delete()
-        self.add_batch(batch)
-
-class Arrow(Line):
-    """draw a line with a dot on the destination end (B)"""
-    def __init__(self, * args, ** kwargs):
-        super(Arrow, self).__init__(*args, **kwargs)
-        self.vertexlist = []
-
-    def delete(self):
-        for obj in self.vertexlist:
-            obj.delete()
-        self.vertexlist = []
-
-    def add_batch(self, batch):
-        x_A, y_A = self.A
-        x_B, y_B = self.B
-
-        C, D = compute_arrow_points(self.A, self.B, radius=14)
-        x_C, y_C = C
-        x_D, y_D = D
-
-        # end the line a little bit before B
-        angle_ab = compute_angle(self.A, self.B)
-        line = batch.add(2,pyglet.gl.GL_LINES,Layers.foreground,
-                         ('v2f', (x_B - math.cos(angle_ab) * 10,
-                                  y_B - math.sin(angle_ab) * 10, x_A, y_A)),
-                         ('c4B', 2 * self.color))
-        arrow_tip = batch.add(3, pyglet.gl.GL_TRIANGLES,Layers.foreground,
-                              ('v2f', (x_B, y_B, x_D, y_D, x_C, y_C)),
-                              ('c4B', 3 * self.color))
-
-        self.vertexlist.append(line)
-        self.vertexlist.append(arrow_tip)
-        return self.vertexlist
-
-class ArrowGroup(object):
-    """regroup multiple arrows together"""
-    def __init__(self, coordinates, lifetime=1, color=HARD_BLACK):
-        self.arrows = []
-        for X, Y in coordinates:
-            arrow = Arrow(X, Y, color=color)
-            arrow.add_batch(batch)
-            self.arrows.append(arrow)
-
-        pyglet.clock.schedule_once(self.die, lifetime)
-
-    def die(self, dt):
-        for arrow in self.arrows:
-            arrow.delete()
+        self.hovered = hovered
+
+class LineSet(object):
+    """lines drawn from a single vertex list, so that they can all be moved
+    with one write (e.g. when the view is panned or zoomed)
+
+    each line takes a slot of two vertices, the slots of deleted lines are
+    reused and the vertex list doubles in size when all the slots are taken.
+    Unused slots are transparent lines of length 0"""
+    def __init__(self, batch, group=Layers.background, capacity=64):
+        self.capacity = capacity
+        self.vertexlist = batch.add(2 * capacity, pyglet.gl.GL_LINES, group,
+                                    ('v2f', (0.,) * 4 * capacity),
+                                    ('c4B', (0,) * 8 * capacity))
+        self.colors = [None] * capacity # color of each slot, None if unused
+        self.free = list(xrange(capacity - 1, -1, -1)) # lowest slots are used first
+
+    def add(self, A, B, color=HARD_BLACK):
+        """draw a line between A and B, return its slot"""
+        if not self.free:
+            self.grow()
+        slot = self.free.pop()
+        self.update_coordinates(slot, A, B)
+        self.update_color(slot, color)
+        return slot
+
+    def grow(self):
+        capacity = self.capacity
+        self.vertexlist.resize(4 * capacity)
+        self.vertexlist.vertices[4 * capacity:] = (0.,) * 4 * capacity
+        self.vertexlist.colors[8 * capacity:] = (0,) * 8 * capacity
+        self.colors.extend([None] * capacity)
+        self.free.extend(xrange(2 * capacity - 1, capacity - 1, -1))
+        self.capacity = 2 * capacity
+
+    def delete(self, slot):
+        self.update_coordinates(slot, (0., 0.), (0., 0.))
+        self.vertexlist.colors[8 * slot:8 * slot + 8] = (0,) * 8
+        self.colors[slot] = None
+        self.free.append(slot)
+
+    def update_coordinates(self, slot, A, B):
+        x_A, y_A = A
+        x_B, y_B = B
+        self.vertexlist.vertices[4 * slot:4 * slot + 4] = (x_A, y_A, x_B, y_B)
+
+    def update_color(self, slot, color):
+        self.colors[slot] = color
+        self.vertexlist.colors[8 * slot:8 * slot + 8] = 2 * color
+
+    def set_coordinates(self, coordinates):
+        """move all the lines at once, coordinates holds the 4 coordinates of
+        each slot (unused slots included)"""
+        self.vertexlist.vertices[:] = coordinates
+
+def arrow_vertices(A, B):
+    """return the vertices of the line and of the tip of an arrow from A to B"""
+    x_A, y_A = A
+    x_B, y_B = B
+
+    C, D = compute_arrow_points(A, B, radius=14)
+    x_C, y_C = C
+    x_D, y_D = D
+
+    # end the line a little bit before B
+    angle_ab = compute_angle(A, B)
+    return ((x_B - math.cos(angle_ab) * 10, y_B - math.sin(angle_ab) * 10, x_A, y_A),
+            (x_B, y_B, x_D, y_D, x_C, y_C))
+
+# below this number of arrows, computing their vertices with NumPy is slower
+BULK_ARROWS = 8
+
+class ArrowPool(object):
+    """short-lived arrows drawn from preallocated vertex lists (one for the
+    lines and one for the tips, GL_LINES and GL_TRIANGLES cannot share a
+    vertex list)
+
+    arrows take the slots of the pool in turn, the oldest arrow being
+    replaced when all the slots are taken. Arrows are hidden once their
+    lifetime is over by sweep(), which should be called every frame"""
+    def __init__(self, batch, capacity=4096, group=Layers.foreground):
+        self.capacity = capacity
+        self.lines = batch.add(2 * capacity, pyglet.gl.GL_LINES, group,
+                               ('v2f', (0.,) * 4 * capacity),
+                               ('c4B', (0,) * 8 * capacity))
+        self.tips = batch.add(3 * capacity, pyglet.gl.GL_TRIANGLES, group,
+                              ('v2f', (0.,) * 6 * capacity),
+                              ('c4B', (0,) * 12 * capacity))
+        self.next_slot = 0
+        self.generations = [0] * capacity # number of arrows drawn in each slot
+        self.expiries = [] # heap of (expiry time, slot, generation)
+
+    def add(self, A, B, lifetime, color=HARD_BLACK, now=None):
+        """draw an arrow from A to B for lifetime seconds"""
+        if now is None:
+            now = time.time()
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.capacity
+        self.generations[slot] += 1
+        heapq.heappush(self.expiries, (now + lifetime, slot, self.generations[slot]))
+        line_vertices, tip_vertices = arrow_vertices(A, B)
+        self.lines.vertices[4 * slot:4 * slot + 4] = line_vertices
+        self.lines.colors[8 * slot:8 * slot + 8] = 2 * color
+        self.tips.vertices[6 * slot:6 * slot + 6] = tip_vertices
+        self.tips.colors[12 * slot:12 * slot + 12] = 3 * color
+
+    def add_many(self, coordinates, lifetime, color=HARD_BLACK, now=None):
+        """draw arrows for a list of (A, B) coordinates, computing all their
+        vertices at once when NumPy is available"""
+        if now is None:
+            now = time.time()
+        if geometry is None or len(coordinates) < BULK_ARROWS:
+            for A, B in coordinates:
+                self.add(A, B, lifetime, color, now)
+            return
+        coordinates = coordinates[-self.capacity:] # the first ones would be replaced
+        capacity = self.capacity
+        slots = [(self.next_slot + i) % capacity for i in xrange(len(coordinates))]
+        self.next_slot = (slots[-1] + 1) % capacity
+        expiry = now + lifetime
+        generations = self.generations
+        for slot in slots:
+            generations[slot] += 1
+            heapq.heappush(self.expiries, (expiry, slot, generations[slot]))
+        line_vertices, tip_vertices = geometry.arrow_vertices(coordinates)
+        geometry.vertex_array(self.lines.vertices, 4)[slots] = line_vertices
+        geometry.vertex_array(self.lines.colors, 8)[slots] = 2 * color
+        geometry.vertex_array(self.tips.vertices, 6)[slots] = tip_vertices
+        geometry.vertex_array(self.tips.colors, 12)[slots] = 3 * color
+
+    def sweep(self, now=None):
+        """hide the arrows whose lifetime is over"""
+        if now is None:
+            now = time.time()
+        expiries = self.expiries
+        generations = self.generations
+        while expiries and expiries[0][0] <= now:
+            expiry, slot, generation = heapq.heappop(expiries)
+            if generation == generations[slot]: # the slot was not reused since
+                self.lines.colors[8 * slot:8 * slot + 8] = (0,) * 8
+                self.tips.colors[12 * slot:12 * slot + 12] = (0,) * 12
+
+    def __len__(self):
+        """number of arrows waiting for their lifetime to be over"""
+        return len(self.expiries)
 
 
 from pyglet.gl import *
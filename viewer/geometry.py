@@ -0,0 +1,116 @@
+"""geometry of the sensor map computed on all the nodes, links and arrows at
+once with NumPy arrays
+
+this module requires NumPy (e.g. pip install numpy), without it the viewer
+computes the geometry of each entity in Python"""
+import numpy as np
+
+def positions(nodes):
+    """return the array of the (x, y) positions of nodes in the simulation
+    area"""
+    return np.array([(node.x, node.y) for node in nodes], dtype=float)
+
+def sizes(nodes):
+    """return the array of the (width, height) sizes of nodes on the screen"""
+    return np.array([node.size for node in nodes], dtype=float)
+
+def transform(positions, scale, trans_x, trans_y, view_trans_x, view_trans_y):
+    """return the screen coordinates of an array of (x, y) positions in the
+    simulation area"""
+    return scale * (positions + (trans_x, trans_y)) + (view_trans_x, view_trans_y)
+
+def link_vertices(centers, ends):
+    """return the vertices (x_A, y_A, x_B, y_B rows) of lines between the
+    nodes of ends, an array of (node A, node B) rows holding the indices of
+    the nodes in centers. Lines whose ends are -1 are drawn at (0, 0)"""
+    centers = np.vstack([centers, np.zeros((1, 2))])
+    return np.hstack([centers[ends[:, 0]], centers[ends[:, 1]]])
+
+def resize_ends(ends, capacity):
+    """return a copy of ends (None at first) extended to capacity rows, new
+    rows being unused lines"""
+    resized = np.empty((capacity, 2), dtype=np.intp)
+    resized.fill(-1)
+    if ends is not None:
+        resized[:len(ends)] = ends
+    return resized
+
+def arrow_angles(A, B):
+    """angles between the x axis and the lines from A to B (arrays of (x, y)
+    rows), same as trig_tools.compute_angle"""
+    dx = A[:, 0] - B[:, 0]
+    dy = A[:, 1] - B[:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        angles = np.arctan(dy / dx)
+    angles = np.where(dy == 0, np.where(A[:, 0] < B[:, 0], 0., np.pi), angles)
+    return np.where(dx == 0, np.where(A[:, 1] < B[:, 1], np.pi/2, - np.pi/2), angles)
+
+def arrow_vertices(coordinates, radius=14, margin=10):
+    """return the vertices of the lines (x, y of the end before B, x_A, y_A
+    rows) and of the tips (B, D, C rows, see trig_tools.compute_arrow_points)
+    of arrows given as a list of (A, B) coordinates"""
+    ends = np.asarray(coordinates, dtype=float)
+    A, B = ends[:, 0], ends[:, 1]
+    angles = arrow_angles(A, B)
+    x_B, y_B = B[:, 0], B[:, 1]
+    lines = np.column_stack([x_B - np.cos(angles) * margin, y_B - np.sin(angles) * margin,
+                             A[:, 0], A[:, 1]])
+    tips = np.column_stack([x_B, y_B,
+                            x_B - np.cos(angles - np.pi/4) * radius,
+                            y_B - np.sin(angles - np.pi/4) * radius,
+                            x_B - np.cos(angles + np.pi/4) * radius,
+                            y_B - np.sin(angles + np.pi/4) * radius])
+    return lines, tips
+
+def vertex_array(attribute, size):
+    """return a NumPy view of an attribute of a pyglet vertex list (e.g.
+    vertex_list.vertices), with rows of size values"""
+    array = np.ctypeslib.as_array(attribute)
+    return array.reshape(len(array) // size, size)
+
+class GridIndex(object):
+    """spatial.GridIndex of the bounding boxes of items, built from the
+    arrays of their (x, y) lower left corners and of their (width, height)
+
+    the cells of the boxes are sorted by cell, a point lookup finds the boxes
+    of its cell by a binary search"""
+    def __init__(self, corners, sizes, items):
+        self.items = items
+        boxes = np.hstack([corners, corners + sizes])
+        self.boxes = boxes.tolist()
+        if len(boxes):
+            cell_size = max((boxes[:, 2:] - boxes[:, :2]).max(), 1.)
+        else:
+            cell_size = 1.
+        self.cell_size = float(cell_size)
+        first = np.floor(boxes[:, :2] / cell_size).astype(np.int64)
+        last = np.floor(boxes[:, 2:] / cell_size).astype(np.int64)
+        # boxes no larger than the cells overlap at most two columns and two rows
+        keys, owners = [], []
+        for column_offset in (0, 1):
+            for row_offset in (0, 1):
+                columns = first[:, 0] + column_offset
+                rows = first[:, 1] + row_offset
+                overlap = (columns <= last[:, 0]) & (rows <= last[:, 1])
+                keys.append(self.key(columns[overlap], rows[overlap]))
+                owners.append(np.nonzero(overlap)[0])
+        keys = np.concatenate(keys)
+        order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[order]
+        self.owners = np.concatenate(owners)[order].tolist()
+
+    @staticmethod
+    def key(column, row):
+        return column * (1 << 32) + row
+
+    def query(self, x, y):
+        """return the items whose bounding box contains (x, y), borders
+        excluded"""
+        key = self.key(int(np.floor(x / self.cell_size)), int(np.floor(y / self.cell_size)))
+        start, end = self.keys.searchsorted([key, key + 1])
+        items = []
+        for owner in self.owners[start:end]:
+            x_min, y_min, x_max, y_max = self.boxes[owner]
+            if x_min < x < x_max and y_min < y < y_max:
+                items.append(self.items[owner])
+        return items
@@ -0,0 +1,41 @@
+"""spatial index of the items displayed on the screen"""
+import math
+
+class GridIndex(object):
+    """uniform grid over the screen, each cell lists the items whose bounding
+    box overlaps it
+
+    with cells at least as large as the bounding boxes, an item is listed in
+    at most four cells and a point lookup only tests the items of one cell"""
+    def __init__(self, cell_size=1.):
+        self.cell_size = float(cell_size)
+        self.cells = {} # (column, row) to a list of (bounding box, item)
+
+    @classmethod
+    def build(cls, items):
+        """return the index of (bounding box, item) pairs, the bounding boxes
+        being (x_min, y_min, x_max, y_max) tuples"""
+        cell_size = max([max(x_max - x_min, y_max - y_min)
+                         for (x_min, y_min, x_max, y_max), item in items] or [1.])
+        index = cls(max(cell_size, 1.))
+        for box, item in items:
+            index.insert(box, item)
+        return index
+
+    def cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def insert(self, box, item):
+        x_min, y_min, x_max, y_max = box
+        column_min, row_min = self.cell(x_min, y_min)
+        column_max, row_max = self.cell(x_max, y_max)
+        cells = self.cells
+        for column in xrange(column_min, column_max + 1):
+            for row in xrange(row_min, row_max + 1):
+                cells.setdefault((column, row), []).append((box, item))
+
+    def query(self, x, y):
+        """return the items whose bounding box contains (x, y), borders
+        excluded"""
+        return [item for (x_min, y_min, x_max, y_max), item in self.cells.get(self.cell(x, y), ())
+                if x_min < x < x_max and y_min < y < y_max]